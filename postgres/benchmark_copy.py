@@ -0,0 +1,95 @@
+import argparse
+import logging
+import time
+import numpy as np
+import pandas as pd
+
+import pgcopy
+from postgre import Postgre, DataFrameCopyStream, BinaryCopyStream
+from etl import Config
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def make_column(sql_type: str, number_rows: int, random_state: np.random.RandomState):
+    """
+    Return a synthetic column of `number_rows` values matching a SQL type definition.
+    """
+    wire = pgcopy.wire_type(sql_type)
+    if wire == pgcopy.TEXT:
+        return pd.Series(random_state.randint(0, 10 ** 9, number_rows)).map('value-{:d}'.format)
+    if wire == pgcopy.TIMESTAMP:
+        epoch_ms = 1541000000000 + random_state.randint(0, 30 * 24 * 3600 * 1000, number_rows)
+        return pd.Series(pd.to_datetime(epoch_ms, unit='ms'))
+    if wire == '?':
+        return pd.Series(random_state.randint(0, 2, number_rows).astype(bool))
+    dtype = np.dtype(wire).newbyteorder('=')
+    if dtype.kind == 'f':
+        return pd.Series(random_state.uniform(0, 1000, number_rows).astype(dtype))
+    return pd.Series(random_state.randint(0, 2 ** 15, number_rows).astype(dtype))
+
+
+def make_table(columns_dict: dict, number_rows: int, seed: int = 0):
+    random_state = np.random.RandomState(seed)
+    return pd.DataFrame({column: make_column(sql_type, number_rows, random_state)
+                         for column, sql_type in columns_dict.items()})
+
+
+def drain(stream, size: int = 65536):
+    """Read a COPY stream to the end, returning the number of bytes/characters produced."""
+    total = 0
+    while True:
+        data = stream.read(size)
+        if not data:
+            return total
+        total += len(data)
+
+
+def time_call(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def run_benchmark(number_rows: int, database_name: str = None, chunk_size: int = 100000):
+    """
+    Compare text (CSV) and binary (PGCOPY) COPY for every star schema table in `Config.table_info`.
+    Encoding is always timed; loads are timed too when a database name is given.
+    Return:
+        {pd.DataFrame} - one row per table and format
+    """
+    config = Config()
+    postgre = Postgre(database_name) if database_name else None
+    results = []
+    for table_name, columns_dict in config.table_info.items():
+        df = make_table(columns_dict, number_rows)
+        for copy_format in ('text', 'binary'):
+            if copy_format == 'binary':
+                stream = BinaryCopyStream(df, columns_dict, chunk_size=chunk_size)
+            else:
+                stream = DataFrameCopyStream(df, chunk_size=chunk_size)
+            encode_seconds, size = time_call(drain, stream)
+            result = {'table': table_name, 'format': copy_format, 'rows': number_rows,
+                      'encode_seconds': encode_seconds, 'size': size}
+            if postgre:
+                benchmark_table_name = f"benchmark_{table_name}"
+                postgre.create_table(benchmark_table_name, columns_dict)
+                result['load_seconds'], _ = time_call(postgre.copy_dataframe_to_table, df, benchmark_table_name,
+                                                      chunk_size=chunk_size, binary=copy_format == 'binary',
+                                                      columns_dict=columns_dict)
+                postgre.drop_table(benchmark_table_name)
+            results.append(result)
+
+    if postgre:
+        postgre.close_connectiion()
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark text and binary COPY for the Sparkify tables")
+    parser.add_argument('--rows', type=int, default=1000000, help="rows generated per table")
+    parser.add_argument('--database', default=None, help="database to load into, encoding only if omitted")
+    parser.add_argument('--chunk-size', type=int, default=100000, help="rows serialized at a time")
+    args = parser.parse_args()
+    print(run_benchmark(args.rows, args.database, args.chunk_size).to_string(index=False))
@@ -0,0 +1,52 @@
+import argparse
+import logging
+import pandas as pd
+from io import StringIO
+
+import copy_text
+from etl import Config
+from benchmark_copy import make_table, time_call
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def to_csv_text(df: pd.DataFrame):
+    file_object = StringIO()
+    df.to_csv(file_object, sep='\t', header=False, index=False, na_rep='')
+    return file_object.getvalue()
+
+
+def row_loop_text(df: pd.DataFrame):
+    """Row by row serialization, as the former `df_rows_to_list` / `list_to_string_io` helpers did."""
+    values = df.values
+    return '\n'.join(['\t'.join([str(entry) for entry in values[index]]) for index in range(df.shape[0])])
+
+
+def run_benchmark(number_rows: int, row_loop: bool = False):
+    """
+    Time the columnar COPY text encoder against `DataFrame.to_csv` (and optionally the former
+    row by row serialization) for every star schema table in `Config.table_info`.
+    Return:
+        {pd.DataFrame} - one row per table and encoder
+    """
+    config = Config()
+    encoders = [('copy_text', copy_text.encode_dataframe), ('to_csv', to_csv_text)]
+    if row_loop:
+        encoders.append(('row_loop', row_loop_text))
+    results = []
+    for table_name, columns_dict in config.table_info.items():
+        df = make_table(columns_dict, number_rows)
+        for encoder, function in encoders:
+            seconds, text = time_call(function, df)
+            results.append({'table': table_name, 'encoder': encoder, 'rows': number_rows, 'seconds': seconds,
+                            'rows_per_second': number_rows / seconds, 'size': len(text)})
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark COPY text encoders for the Sparkify tables")
+    parser.add_argument('--rows', type=int, default=1000000, help="rows generated per table")
+    parser.add_argument('--row-loop', action='store_true', help="also time the row by row serialization")
+    args = parser.parse_args()
+    print(run_benchmark(args.rows, args.row_loop).to_string(index=False))
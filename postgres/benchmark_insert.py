@@ -0,0 +1,57 @@
+import argparse
+import logging
+import pandas as pd
+
+from postgre import Postgre
+from etl import Config
+from benchmark_copy import make_table, time_call
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def run_benchmark(database_name: str, sizes: list, page_size: int = 1000):
+    """
+    Measure insert, upsert and delete throughput of `Postgre` on a scratch copy of the songs table.
+    Return:
+        {pd.DataFrame} - one row per operation and number of records
+    """
+    config = Config()
+    postgre = Postgre(database_name)
+    table_name = f"benchmark_{config.songs_table_name}"
+    columns_dict = config.table_info.get(config.songs_table_name)
+    key_columns = ['song_id']
+    results = []
+    for number_records in sizes:
+        df = make_table(columns_dict, number_records)
+        df['song_id'] = pd.Series(range(number_records)).map('SO{:016d}'.format)
+        columns = list(df.columns)
+        records = list(zip(*(df[column].tolist() for column in columns)))
+        keys = [(song_id,) for song_id in df['song_id']]
+
+        postgre.create_table(table_name, columns_dict)
+        postgre.add_primary_key(table_name, key_columns)
+        operations = (
+            ('insert', postgre.insert_records, (table_name, records, columns), {'page_size': page_size}),
+            ('upsert', postgre.insert_records, (table_name, records, columns),
+             {'key_columns': key_columns, 'page_size': page_size}),
+            ('delete', postgre.delete_records, (table_name, keys, key_columns), {'page_size': page_size}),
+        )
+        for operation, function, args, kwargs in operations:
+            seconds, affected = time_call(function, *args, **kwargs)
+            results.append({'operation': operation, 'records': number_records, 'affected': affected,
+                            'seconds': seconds, 'records_per_second': number_records / seconds})
+        postgre.drop_table(table_name)
+
+    postgre.close_connectiion()
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark batched insert, upsert and delete in Postgre")
+    parser.add_argument('--database', required=True, help="database to run the benchmark in")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000],
+                        help="numbers of records to write")
+    parser.add_argument('--page-size', type=int, default=1000, help="rows per statement")
+    args = parser.parse_args()
+    print(run_benchmark(args.database, args.sizes, args.page_size).to_string(index=False))
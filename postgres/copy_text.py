@@ -0,0 +1,84 @@
+from io import StringIO
+import numpy as np
+import pandas as pd
+
+NULL = '\\N'
+ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def escape_strings(values: np.ndarray):
+    """
+    Escape backslashes, tabs, newlines and carriage returns for the COPY text format.
+    The special characters are searched once over all the values joined together, so the common
+    case of a column without any of them costs a single scan and no per value work.
+    """
+    joined = ''.join(values)
+    if not any(character in joined for character in '\\\t\n\r'):
+        return values
+    return np.array([value.translate(ESCAPES) for value in values], dtype=object)
+
+
+def encode_column(column):
+    """
+    Encode one column as an object array of COPY text fields, missing values as `\\N`.
+    Categoricals encode their categories once and take them by code; datetimes, numbers and
+    booleans are formatted in bulk by NumPy.
+    Argument:
+        - column {pd.Series|np.ndarray|list} - column values
+    Return:
+        {np.ndarray} - object array of encoded fields
+    """
+    series = column if isinstance(column, pd.Series) else pd.Series(column)
+    null_mask = series.isna().to_numpy()
+    dtype = series.dtype
+
+    if isinstance(dtype, pd.CategoricalDtype):
+        categories = encode_column(pd.Series(dtype.categories))
+        encoded = np.append(categories, NULL).astype(object)
+        return encoded[series.cat.codes.to_numpy()]
+
+    encoded = np.full(series.shape[0], NULL, dtype=object)
+    values = series[~null_mask]
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        encoded[~null_mask] = np.datetime_as_string(values.to_numpy().astype('datetime64[us]'), unit='us')
+    elif pd.api.types.is_bool_dtype(dtype):
+        encoded[~null_mask] = np.where(values.to_numpy(dtype=bool), 't', 'f')
+    elif pd.api.types.is_integer_dtype(dtype):
+        encoded[~null_mask] = list(map(str, values.to_numpy(dtype=np.int64).tolist()))
+    elif pd.api.types.is_float_dtype(dtype):
+        float_dtype = getattr(dtype, 'numpy_dtype', dtype)
+        encoded[~null_mask] = values.to_numpy(dtype=float_dtype).astype(str)
+    else:
+        encoded[~null_mask] = escape_strings(np.array(list(map(str, values.to_numpy(dtype=object))), dtype=object))
+    return encoded
+
+
+def encode_columns(columns: list, sep: str = '\t'):
+    """
+    Encode a list of equally long columns as COPY text, one line per row.
+    Return:
+        {str} - COPY text, every row terminated by a newline
+    """
+    if not columns or not len(columns[0]):
+        return ''
+    fields = [encode_column(column) for column in columns]
+    return '\n'.join(map(sep.join, zip(*fields))) + '\n'
+
+
+def encode_dataframe(df: pd.DataFrame, sep: str = '\t'):
+    """
+    Encode a DataFrame as correctly escaped COPY text in one columnar pass.
+    Example:
+        encode_dataframe(pd.DataFrame({'title': ['City Slickers', None], 'year': [2008, 2003]}))
+        'City Slickers\\t2008\\n\\\\N\\t2003\\n'
+    """
+    return encode_columns([df[column] for column in df.columns], sep)
+
+
+def to_string_io(data, sep: str = '\t'):
+    """
+    Return a file like object holding the COPY text of a DataFrame or of a list of columns.
+    """
+    if isinstance(data, pd.DataFrame):
+        return StringIO(encode_dataframe(data, sep))
+    return StringIO(encode_columns(list(data), sep))
@@ -0,0 +1,107 @@
+import re
+import resource
+import logging
+import pandas as pd
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+PANDAS_DTYPES = {
+    'SMALLINT': 'Int16',
+    'INTEGER': 'Int32',
+    'INT': 'Int32',
+    'BIGINT': 'Int64',
+    'REAL': 'float32',
+    'DOUBLE': 'float64',
+    'FLOAT': 'float64',
+}
+
+
+def sql_to_dtype(sql_type: str):
+    """
+    Return the compact pandas dtype of a SQL column definition, None to keep the parsed dtype.
+    Example:
+        'INTEGER' -> 'Int32', 'REAL' -> 'float32', 'VARCHAR(100)' -> None
+    """
+    match = re.match(r'\s*([A-Za-z]+)', sql_type)
+    return PANDAS_DTYPES.get(match.group(1).upper()) if match else None
+
+
+def column_dtypes(config):
+    """
+    Map every raw column to its compact dtype from `Config.table_info`, `Config.raw_column_info`
+    for the raw fields no table keeps, and `Config.categorical_columns` for low cardinality strings.
+    Return:
+        {dict} - column name to pandas dtype
+    """
+    dtypes = {}
+    for columns_dict in list(config.table_info.values()) + [config.raw_column_info]:
+        for column, sql_type in columns_dict.items():
+            dtype = sql_to_dtype(sql_type)
+            if dtype:
+                dtypes[column] = dtype
+    for column in config.categorical_columns:
+        dtypes[column] = 'category'
+    return dtypes
+
+
+def compact_dataframe(df: pd.DataFrame, dtypes: dict):
+    """
+    Cast the columns of a DataFrame to their compact dtypes. Numeric columns are coerced first,
+    so empty strings such as a logged out `userId` become missing values of a nullable integer.
+    """
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+        if dtype == 'category':
+            df[column] = df[column].astype('category')
+        else:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype(dtype)
+    return df
+
+
+def concat_compact(frames: list):
+    """
+    Concatenate compacted frames keeping categorical columns categorical, by giving every frame
+    the union of the categories of each column first.
+    """
+    if not frames:
+        return pd.DataFrame()
+    categorical_columns = {column for frame in frames for column in frame.columns
+                           if isinstance(frame[column].dtype, pd.CategoricalDtype)}
+    for column in categorical_columns:
+        categories = pd.api.types.union_categoricals(
+            [frame[column] for frame in frames if column in frame.columns]).categories
+        for frame in frames:
+            if column in frame.columns:
+                frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def memory_usage_mb(df: pd.DataFrame):
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+def peak_rss_mb():
+    """Peak resident set size of the process in MB (ru_maxrss is reported in KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MemoryReport(object):
+    """
+    Accumulates the memory used by DataFrame batches before and after compaction.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.before_mb = 0.0
+        self.after_mb = 0.0
+
+    def add(self, before_mb: float, after_mb: float):
+        self.before_mb += before_mb
+        self.after_mb += after_mb
+
+    def log(self):
+        ratio = self.before_mb / self.after_mb if self.after_mb else 0
+        logger.info(f"Memory {self.name}: {self.before_mb:.1f} MB -> {self.after_mb:.1f} MB "
+                    f"({ratio:.1f}x), peak RSS {peak_rss_mb():.1f} MB")
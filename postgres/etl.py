@@ -1,67 +1,108 @@
 import os
-import glob
 import psycopg2
 import pandas as pd
-import json
-from io import StringIO
+import time
+import argparse
 import logging
-import datetime
 
 from postgre import Postgre
+from song_matcher import SongArtistIndex, match_song_artist_ids, match_in_database
+from json_reader import JsonReader, list_json_files
+from manifest import FileManifest
+from sql_engine import SqlEngine
+from dtypes import column_dtypes, compact_dataframe, concat_compact, memory_usage_mb, peak_rss_mb, MemoryReport
+from metrics import RunMetrics
+from profiling import StageProfiler
+from spill import SpillStore
+from pipeline import AsyncPipeline
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
-def get_json_data(filepath):
-    for root, dirs, files in os.walk(filepath):
-        files = glob.glob(os.path.join(root,'*.json'))
-        for file in files :
-            with open(os.path.abspath(file), 'r') as f:
-                try:
-                    yield json.load(f)
-                except:
-                    with open(os.path.abspath(file), 'r') as f:
-                        for line in f.readlines():
-                            try:
-                                yield json.loads(line)
-                            except:
-                                yield None
-
-def df_rows_to_list(df:pd.DataFrame, number_of_rows:int=None):
-    list_of_row_values = []
-    number_of_rows = number_of_rows if number_of_rows else df.shape[0]
-    for index in range(0, number_of_rows):
-        list_of_row_values.append(list(df.values[index]))
-    
-    return list_of_row_values
-
-def list_to_string_io(list_of_entries:list):
+def get_json_data(filepath:str, workers:int=None, batch_size:int=50000, files:list=None, columns:list=None,
+                  where:dict=None):
     """
-    Return file like object of the type StringIO from a given list of list of strings.
+    Yield batches of records from every JSON / NDJSON file under filepath.
+    Files are read once and spread across a pool of `workers` processes.
     Argument:
-        - list_of_entries {list} - list of list of strings to transform to StringIO
-    Example:
-        [
-             ['AR8IEZO1187B99055E', 'SOINLJW12A8C13314C', 'City Slickers', 2008, 149.86404],
-             ['AR558FS1187FB45658', 'SOGDBUF12A8C140FAA', 'Intro', 2003, 75.67628]
-        ]
-        
+        - filepath {str} - root directory of the JSON files
+        - workers {int} - number of reader processes, defaults to the number of CPUs
+        - batch_size {int} - maximum number of records per yielded batch
+        - files {list} - read only these files instead of every file under filepath
+        - columns {list} - keep only these fields of every record
+        - where {dict} - field to accepted values, other records are dropped while parsing
     Return:
-        {StringIO} - file type object with values in input list concatenated.
-    
-    Example:
-        'AR8IEZO1187B99055E\tSOINLJW12A8C13314C\tCity Slickers\t2008\t149.86404\n
-         AR558FS1187FB45658\tSOGDBUF12A8C140FAA\tIntro\t2003\t75.67628'
+        {generator} - lists of record dicts
     """
-    return StringIO('\n'.join(['\t'.join([str(entry) for entry in set_of_entries]) for set_of_entries in list_of_entries]))
+    reader = JsonReader(workers=workers, batch_size=batch_size, columns=columns, where=where)
+    if files is not None:
+        yield from reader.iter_file_batches(files, filepath)
+    else:
+        yield from reader.iter_batches(filepath)
 
+def get_json_dataframe(filepath:str, workers:int=None, batch_size:int=50000, files:list=None, dtypes:dict=None,
+                       columns:list=None, where:dict=None):
+    """
+    Build a single DataFrame from the record batches yielded by `get_json_data`.
+    With `dtypes` (see `dtypes.column_dtypes`) every batch is compacted as soon as it is parsed,
+    so the full frame never exists with generic object / float64 columns, and the memory
+    used before and after compaction is logged. `columns` and `where` are pushed down
+    to the reader, so dropped fields and records are never part of any frame.
+    """
+    report = MemoryReport(filepath)
+    frames = []
+    for batch in get_json_data(filepath, workers, batch_size, files, columns, where):
+        frame = pd.DataFrame.from_records(batch)
+        if dtypes:
+            before_mb = memory_usage_mb(frame)
+            frame = compact_dataframe(frame, dtypes)
+            report.add(before_mb, memory_usage_mb(frame))
+        frames.append(frame)
+    if dtypes:
+        report.log()
+    return concat_compact(frames)
 
-def convert_timestamp(timestamp_miliseconds_list:list):
-    series = []
-    for record in timestamp_miliseconds_list:
-         series.append(datetime.datetime.fromtimestamp(record/1000.0))
-    return series
+def build_time_table(logs_df:pd.DataFrame, ts_column:str='ts'):
+    """
+    Build the time dimension from the NextSong events of the log, one row per distinct timestamp.
+    Epoch milliseconds are converted in bulk and every field is derived with columnar operations.
+    Argument:
+        - logs_df {pd.DataFrame} - log events with a `page` column and epoch milliseconds in `ts_column`
+    Return:
+        {pd.DataFrame} - timestamp, hour, day, week, month, year and weekday columns
+    """
+    timestamps = logs_df.loc[logs_df['page'] == 'NextSong', ts_column].dropna().drop_duplicates()
+    timestamp = pd.Series(pd.to_datetime(timestamps.to_numpy(dtype='int64'), unit='ms'), name='timestamp')
+    return pd.DataFrame({
+        'timestamp': timestamp,
+        'hour': timestamp.dt.hour,
+        'day': timestamp.dt.day,
+        'week': timestamp.dt.isocalendar().week.astype('int64'),
+        'month': timestamp.dt.month,
+        'year': timestamp.dt.year,
+        'weekday': timestamp.dt.weekday,
+    })
+
+def build_users_table(logs_df:pd.DataFrame, column_names:list, user_column:str='userId', ts_column:str='ts'):
+    """
+    Build the users dimension with the latest state of every user, one row per user.
+    Events without a valid user id (empty for logged out sessions) are dropped, and for each user
+    the row of its most recent event by `ts_column` is kept with one group-wise reduction.
+    Argument:
+        - logs_df {pd.DataFrame} - log events
+        - column_names {list} - users table columns, as in `Config.table_info`
+    Return:
+        {pd.DataFrame} - the users table columns, one row per user id
+    """
+    user_ids = logs_df[user_column]
+    if not pd.api.types.is_integer_dtype(user_ids):
+        user_ids = pd.to_numeric(user_ids, errors='coerce').astype('Int64')
+    valid = (user_ids.notna() & logs_df[ts_column].notna()).to_numpy()
+    columns = list(dict.fromkeys([ts_column] + column_names))
+    events = logs_df.loc[valid, columns].assign(**{user_column: user_ids[valid]})
+    latest = events.groupby(user_column, sort=False, observed=True)[ts_column].idxmax()
+    return events.loc[latest.to_numpy(), column_names].reset_index(drop=True)
 
 class Config(object):
     songs_table_name = "songs"
@@ -69,6 +110,24 @@ class Config(object):
     time_table_name = "time"
     users_table_name = "users"
     songsplay_table_name = 'songplays'
+    binary_copy_tables = (time_table_name, songsplay_table_name)
+    max_concurrent_loads = 4
+    # JSON reader processes, None for one per CPU
+    reader_workers = None
+    manifest_table_name = 'etl_manifest'
+    log_columns = ['ts', 'userId', 'firstName', 'lastName', 'gender', 'level', 'sessionId', 'location', 'userAgent',
+                   'song', 'artist', 'length', 'page']
+    log_filter = {'page': ['NextSong']}
+    categorical_columns = ['level', 'gender', 'page', 'method', 'auth', 'firstName', 'lastName', 'location', 'userAgent']
+    raw_column_info = {'auth': 'VARCHAR(20)',
+                       'itemInSession': 'INTEGER',
+                       'length': 'REAL',
+                       'method': 'CHAR(3)',
+                       'page': 'VARCHAR(50)',
+                       'registration': 'DOUBLE PRECISION',
+                       'status': 'SMALLINT',
+                       'num_songs': 'SMALLINT',
+                       }
     table_info ={
         songs_table_name: {'artist_id': 'CHAR(18) NOT NULL',
                            'song_id': 'CHAR(18) NOT NULL',
@@ -85,7 +144,7 @@ class Config(object):
         time_table_name: {'day': 'INTEGER',
                           'hour': 'INTEGER',
                           'month': 'INTEGER',
-                          'timestamp': 'TIMESTAMP(6)',
+                          'timestamp': 'TIMESTAMP(6) NOT NULL',
                           'week': 'INTEGER',
                           'weekday': 'INTEGER',
                           'year': 'INTEGER',       
@@ -107,91 +166,427 @@ class Config(object):
                      "userAgent":"VARCHAR(255)",
             }
         }
+    table_keys = {
+        songs_table_name: ['song_id'],
+        artists_table_name: ['artist_id'],
+        time_table_name: ['timestamp'],
+        users_table_name: ['userId'],
+        # userId is nullable, so this key is built as a unique index, never a primary key
+        songsplay_table_name: ['ts', 'userId', 'sessionId'],
+        }
+    table_indexes = {
+        songs_table_name: [['title'], ['artist_id']],
+        artists_table_name: [['artist_name']],
+        songsplay_table_name: [['userId'], ['song_id'], ['artist_id']],
+        }
+
+    def bulk_load_tables(self):
+        """
+        Keys and secondary indexes built once the tables are loaded, see `Postgre.finalize_bulk_load`.
+        A key becomes the primary key when all its columns are declared NOT NULL in `table_info`.
+        """
+        return {table_name: {'key_columns': self.table_keys.get(table_name),
+                             'primary_key': all('NOT NULL' in columns_dict.get(column, '').upper()
+                                                for column in self.table_keys.get(table_name, [])),
+                             'indexes': self.table_indexes.get(table_name, [])}
+                for table_name, columns_dict in self.table_info.items()}
 
     
-def get_song_artist_id(postgre:Postgre, song_title:str, artist_name, song_duration:int, config:Config):
-    results = [None, None]
-    if all((song_title, artist_name, song_duration)):
-        song_select ="""SELECT DISTINCT a.song_id, a.artist_id
-                    FROM {SONGS_TABLE_NAME} a
-                    FULL JOIN {ARTISTS_TABLE_NAME} b ON a.artist_id = b.artist_id
-                    WHERE a.title='{SONG_TITLE}'
-                    -- AND a.duration={SONG_DURATION}
-                    -- AND b.artist_name='{ARTIST_NAME}'
-                    """
-
-        results = postgre._execute_query(song_select.format(
-                                                    SONGS_TABLE_NAME=config.songs_table_name,
-                                                    ARTISTS_TABLE_NAME=config.artists_table_name,
-                                                    SONG_TITLE=song_title.replace("'","''"),
-                                                    SONG_DURATION=song_duration,
-                                                    ARTIST_NAME=artist_name.replace("'","''") ), 
-                                         results=True)
-        if results:
-            results = list(results[0].values())
-
-    return results    
-
-def main():
+def build_dimension_tables(songs_df:pd.DataFrame, logs_df:pd.DataFrame, config:Config):
+    """
+    Build the songs, artists, time and users DataFrames. Tables without source data are left out.
+    Return:
+        {dict} - table name to its DataFrame
+    """
+    tables_dataframes = {}
+    if not songs_df.empty:
+        songs_column_names = list(config.table_info.get(config.songs_table_name).keys())
+        tables_dataframes[config.songs_table_name] = songs_df[songs_column_names]
+        artists_column_names = list(config.table_info.get(config.artists_table_name).keys())
+        tables_dataframes[config.artists_table_name] = songs_df[artists_column_names]
+    if not logs_df.empty:
+        tables_dataframes[config.time_table_name] = build_time_table(logs_df)
+        users_column_names = list(config.table_info.get(config.users_table_name).keys())
+        tables_dataframes[config.users_table_name] = build_users_table(logs_df, users_column_names)
+    return tables_dataframes
+
+def build_songplay_table(logs_df:pd.DataFrame, song_artist_ids:pd.DataFrame, config:Config):
+    logs_df[['song_id', 'artist_id']] = song_artist_ids
+    songplay_column_names = list(config.table_info.get(config.songsplay_table_name).keys())
+    return logs_df[songplay_column_names]
+
+def drop_duplicate_keys(table_df:pd.DataFrame, table_name:str, config:Config):
+    """
+    Keep the last row of each key of a table, as `Postgre.delete_duplicates` does once the rows are loaded.
+    Rows with a null key column are kept, they never collide in a unique index. The dropped rows are logged.
+    Return:
+        {pd.DataFrame} - the rows of `table_df` with a unique key
+    """
+    key_columns = config.table_keys.get(table_name)
+    duplicated = table_df.duplicated(subset=key_columns, keep='last') & table_df[key_columns].notna().all(axis=1)
+    if duplicated.any():
+        logger.info(f"Table {table_name}: dropped {int(duplicated.sum())} Records repeating a key of {key_columns}")
+    return table_df[~duplicated]
+
+def files_size(files:list):
+    return sum(os.path.getsize(path) for path in files)
+
+def load_full(postgre:Postgre, config:Config, songs_filepath:str, logs_filepath:str, metrics:RunMetrics=None):
+    """
+    Reload every raw file into freshly created star schema tables and record them in the manifest.
+    Every stage is measured in `metrics`.
+    """
+    metrics = metrics or RunMetrics('sparkify_postgres')
+    manifest = FileManifest(postgre, config.manifest_table_name)
+    manifest.create_table()
+    song_files = list_json_files(songs_filepath)
+    log_files = list_json_files(logs_filepath)
+
+    with metrics.stage('read_songs', bytes=files_size(song_files)) as stage:
+        songs_df = get_json_dataframe(songs_filepath, files=song_files, dtypes=column_dtypes(config),
+                                      workers=config.reader_workers)
+        stage.rows_out = songs_df.shape[0]
+    with metrics.stage('read_logs', bytes=files_size(log_files)) as stage:
+        logs_df = get_json_dataframe(logs_filepath, files=log_files, dtypes=column_dtypes(config),
+                                     columns=config.log_columns, where=config.log_filter, workers=config.reader_workers)
+        stage.rows_out = logs_df.shape[0]
+    with metrics.stage('build_dimensions', rows_in=songs_df.shape[0] + logs_df.shape[0]) as stage:
+        tables_dataframes = {table_name: drop_duplicate_keys(table_df, table_name, config)
+                             for table_name, table_df in build_dimension_tables(songs_df, logs_df, config).items()}
+        dimension_rows = sum(table_df.shape[0] for table_df in tables_dataframes.values())
+        stage.rows_out = dimension_rows
+    with metrics.stage('load_dimensions', rows_in=dimension_rows) as stage:
+        reports = postgre.load_tables_concurrently({table_name: {'df': table_df,
+                                                                 'columns_dict': config.table_info.get(table_name),
+                                                                 'binary': table_name in config.binary_copy_tables}
+                                                    for table_name, table_df in tables_dataframes.items()},
+                                                   max_workers=config.max_concurrent_loads)
+        stage.rows_out = sum(report.get('records') or 0 for report in reports.values())
+        stage.bytes = int(sum(memory_usage_mb(table_df) for table_df in tables_dataframes.values()) * 1024 ** 2)
+
+    with metrics.stage('match_songs', rows_in=logs_df.shape[0]) as stage:
+        song_artist_ids = match_song_artist_ids(postgre,
+                                                logs_df,
+                                                songs_df,
+                                                tables_dataframes[config.artists_table_name],
+                                                config.songs_table_name,
+                                                config.artists_table_name)
+        stage.rows_out = int(song_artist_ids['song_id'].notna().sum())
+    with metrics.stage('load_songplays', rows_in=logs_df.shape[0]) as stage:
+        songplay_df = build_songplay_table(logs_df, song_artist_ids, config)
+        postgre.create_table(table_name=config.songsplay_table_name, columns_dict=config.table_info.get(config.songsplay_table_name))
+        songplay_df = drop_duplicate_keys(songplay_df, config.songsplay_table_name, config)
+        stage.rows_out = postgre.copy_dataframe_to_table(songplay_df, config.songsplay_table_name,
+                                                         binary=config.songsplay_table_name in config.binary_copy_tables,
+                                                         columns_dict=config.table_info.get(config.songsplay_table_name))
+        stage.bytes = int(memory_usage_mb(songplay_df) * 1024 ** 2)
+    with metrics.stage('finalize_bulk_load'):
+        postgre.finalize_bulk_load(config.bulk_load_tables(), max_workers=config.max_concurrent_loads)
+    manifest.record(manifest.file_entries(song_files + log_files))
+
+def chunk_settings(max_memory_mb:int, workers:int, parsed_bytes_per_raw_byte:int=4, bytes_per_row:int=2048):
+    """
+    Split a memory budget between the JSON readers and the log chunk being transformed.
+    Half of the budget goes to the parsed reader tasks held at once (two per worker, each about
+    `parsed_bytes_per_raw_byte` times its raw size), the other half to the events of one chunk,
+    at about `bytes_per_row` for the records, the DataFrame and the tables derived from it.
+    Return:
+        {tuple} - reader task size in bytes, number of events per chunk
+    """
+    budget = max_memory_mb * 1024 ** 2 / 2
+    chunk_bytes = max(1024 ** 2, int(budget / (2 * workers * parsed_bytes_per_raw_byte)))
+    batch_size = max(1000, int(budget / bytes_per_row))
+    return chunk_bytes, batch_size
+
+def load_song_catalog(postgre:Postgre, config:Config, songs_filepath:str, song_files:list, metrics:RunMetrics):
+    """
+    Load the songs and artists tables and return the in-memory index matching log events against them.
+    Return:
+        {SongArtistIndex} - None when there are no songs, log events are then matched in the database
+    """
+    with metrics.stage('read_songs', bytes=files_size(song_files)) as stage:
+        songs_df = get_json_dataframe(songs_filepath, files=song_files, dtypes=column_dtypes(config),
+                                      workers=config.reader_workers)
+        stage.rows_out = songs_df.shape[0]
+    with metrics.stage('load_dimensions', rows_in=songs_df.shape[0]) as stage:
+        tables_dataframes = {table_name: drop_duplicate_keys(table_df, table_name, config)
+                             for table_name, table_df in build_dimension_tables(songs_df, pd.DataFrame(), config).items()}
+        reports = postgre.load_tables_concurrently({table_name: {'df': table_df,
+                                                                 'columns_dict': config.table_info.get(table_name),
+                                                                 'binary': table_name in config.binary_copy_tables}
+                                                    for table_name, table_df in tables_dataframes.items()},
+                                                   max_workers=config.max_concurrent_loads)
+        stage.rows_out = sum(report.get('records') or 0 for report in reports.values())
+    artists_df = tables_dataframes.get(config.artists_table_name)
+    return SongArtistIndex.from_dataframes(songs_df, artists_df) if artists_df is not None else None
+
+def build_log_chunk(batch:list, config:Config, index:SongArtistIndex, postgre:Postgre):
+    """
+    Transform one chunk of log records into its time and songplays rows, and its users reduced
+    to one row per user with the `ts` of their latest event.
+    Return:
+        {dict} - table name to the chunk's DataFrame
+    """
+    logs_df = compact_dataframe(pd.DataFrame.from_records(batch), column_dtypes(config))
+    song_artist_ids = (index.match(logs_df) if index is not None else
+                       match_in_database(postgre, logs_df, config.songs_table_name, config.artists_table_name))
+    chunk_tables = {config.time_table_name: build_time_table(logs_df),
+                    config.songsplay_table_name: build_songplay_table(logs_df, song_artist_ids, config)}
+    chunk_tables = {table_name: drop_duplicate_keys(table_df, table_name, config)
+                    for table_name, table_df in chunk_tables.items()}
+    users_column_names = list(config.table_info.get(config.users_table_name).keys())
+    chunk_tables[config.users_table_name] = build_users_table(logs_df, ['ts'] + users_column_names)
+    return chunk_tables
+
+def copy_log_chunk(postgre:Postgre, config:Config, chunk_tables:dict):
+    """
+    COPY the time and songplays rows of a log chunk, see `build_log_chunk`.
+    Return:
+        {int} - number of rows copied
+    """
+    return sum(postgre.copy_dataframe_to_table(chunk_tables[table_name], table_name,
+                                               binary=table_name in config.binary_copy_tables,
+                                               columns_dict=config.table_info.get(table_name))
+               for table_name in (config.time_table_name, config.songsplay_table_name))
+
+def finish_chunked_load(postgre:Postgre, config:Config, users_df:pd.DataFrame, metrics:RunMetrics):
+    """
+    Load the users reduced from the per chunk users, delete the time and songplays rows repeated
+    across chunks, then build the keys and indexes.
+    """
+    with metrics.stage('load_users') as stage:
+        if not users_df.empty:
+            users_column_names = list(config.table_info.get(config.users_table_name).keys())
+            users_df = build_users_table(users_df, users_column_names)
+            stage.rows_out = postgre.load_table(config.users_table_name, users_df,
+                                                config.table_info.get(config.users_table_name))['records']
+    with metrics.stage('delete_duplicates') as stage:
+        stage.rows_out = sum(postgre.delete_duplicates(table_name, config.table_keys.get(table_name)) or 0
+                             for table_name in (config.time_table_name, config.songsplay_table_name))
+    with metrics.stage('finalize_bulk_load'):
+        postgre.finalize_bulk_load(config.bulk_load_tables(), max_workers=config.max_concurrent_loads)
+
+def log_chunk_reader(config:Config, max_memory_mb:int=None, workers:int=None):
+    """
+    Reader of the log events, in chunks sized by `chunk_settings` when a memory budget is given.
+    """
+    workers = workers or config.reader_workers
+    settings = {}
+    if max_memory_mb:
+        chunk_bytes, batch_size = chunk_settings(max_memory_mb, workers or os.cpu_count() or 1)
+        settings = {'chunk_bytes': chunk_bytes, 'batch_size': batch_size}
+        logger.info(f"Memory budget {max_memory_mb} MB: chunks of {batch_size} events, "
+                    f"reader tasks of {chunk_bytes / 1024 ** 2:.1f} MB")
+    return JsonReader(workers=workers, columns=config.log_columns, where=config.log_filter, **settings)
+
+def load_out_of_core(postgre:Postgre, config:Config, songs_filepath:str, logs_filepath:str, max_memory_mb:int,
+                     metrics:RunMetrics=None, spill_dir:str=None, workers:int=None):
+    """
+    Full reload processing the log events in chunks sized to a memory budget, for logs larger than RAM.
+    The songs catalog is loaded first and kept in memory for the matching. Each log chunk is then parsed,
+    its time and songplays rows are COPYed before the next chunk is read, and its users reduced to one
+    row per user are spilled to local disk (see `SpillStore`). Once every chunk is loaded, the spilled
+    users are reduced to their latest state and loaded, the rows repeated across chunks are deleted
+    in the database and the keys and indexes are built.
+    Argument:
+        - max_memory_mb {int} - memory budget of the log pipeline in MB, see `chunk_settings`
+        - spill_dir {str} - directory of the spilled partitions, a temporary directory by default
+        - workers {int} - number of reader processes, defaults to the number of CPUs
+    """
+    metrics = metrics or RunMetrics('sparkify_postgres')
+    manifest = FileManifest(postgre, config.manifest_table_name)
+    manifest.create_table()
+    song_files = list_json_files(songs_filepath)
+    log_files = list_json_files(logs_filepath)
+
+    index = load_song_catalog(postgre, config, songs_filepath, song_files, metrics)
+    for table_name in (config.time_table_name, config.songsplay_table_name):
+        postgre.create_table(table_name, config.table_info.get(table_name))
+    reader = log_chunk_reader(config, max_memory_mb, workers)
+
+    with SpillStore(spill_dir) as spill:
+        with metrics.stage('load_log_chunks', rows_in=0, bytes=files_size(log_files)) as stage:
+            stage.rows_out = 0
+            for number, batch in enumerate(reader.iter_file_batches(log_files, logs_filepath)):
+                stage.rows_in += len(batch)
+                chunk_tables = build_log_chunk(batch, config, index, postgre)
+                del batch
+                stage.rows_out += copy_log_chunk(postgre, config, chunk_tables)
+                spill.spill(config.users_table_name, chunk_tables[config.users_table_name])
+                logger.info(f"Log chunk {number} loaded, peak RSS {peak_rss_mb():.1f} MB")
+                del chunk_tables
+        users_df = spill.read(config.users_table_name)
+
+    finish_chunked_load(postgre, config, users_df, metrics)
+    manifest.record(manifest.file_entries(song_files + log_files))
+
+def load_pipelined(postgre:Postgre, config:Config, songs_filepath:str, logs_filepath:str, metrics:RunMetrics=None,
+                   queue_depth:int=2, writers:int=1, max_memory_mb:int=None, workers:int=None):
+    """
+    Full reload overlapping the parsing, transformation and COPY of the log events with an `AsyncPipeline`.
+    Log chunks flow from the JSON readers to `build_log_chunk` and to `copy_log_chunk`, run by `writers`
+    writers over their own pooled connections, through queues of `queue_depth` chunks. The users of every
+    chunk are gathered and, as in `load_out_of_core`, finished once all chunks are loaded.
+    Argument:
+        - queue_depth {int} - chunks buffered between two stages before the upstream stage waits
+        - writers {int} - concurrent COPY writers
+        - max_memory_mb {int} - size the chunks to this memory budget, see `chunk_settings`
+    """
+    metrics = metrics or RunMetrics('sparkify_postgres')
+    manifest = FileManifest(postgre, config.manifest_table_name)
+    manifest.create_table()
+    song_files = list_json_files(songs_filepath)
+    log_files = list_json_files(logs_filepath)
+
+    index = load_song_catalog(postgre, config, songs_filepath, song_files, metrics)
+    for table_name in (config.time_table_name, config.songsplay_table_name):
+        postgre.create_table(table_name, config.table_info.get(table_name))
+    reader = log_chunk_reader(config, max_memory_mb, workers)
+    users_frames = []
+
+    def write_chunk(chunk_tables:dict):
+        with postgre.pooled_connection() as conn:
+            rows = copy_log_chunk(postgre.with_connection(conn), config, chunk_tables)
+        users_frames.append(chunk_tables[config.users_table_name])
+        return rows
+
+    with metrics.stage('load_log_chunks', bytes=files_size(log_files)) as stage:
+        pipeline = AsyncPipeline(reader.iter_file_batches(log_files, logs_filepath),
+                                 lambda batch: build_log_chunk(batch, config, index, postgre),
+                                 write_chunk, queue_depth=queue_depth, writers=writers)
+        counters = pipeline.run()
+        stage.rows_in, stage.rows_out = counters['reader'].rows, counters['writer'].rows
+
+    finish_chunked_load(postgre, config, concat_compact(users_frames), metrics)
+    manifest.record(manifest.file_entries(song_files + log_files))
+
+def load_incremental(postgre:Postgre, config:Config, songs_filepath:str, logs_filepath:str, metrics:RunMetrics=None):
+    """
+    Read only the raw files that are new or changed since the last run and merge their rows into
+    the existing star schema with upserts keyed on `Config.table_keys`. Every stage is measured in `metrics`.
+    """
+    metrics = metrics or RunMetrics('sparkify_postgres')
+    manifest = FileManifest(postgre, config.manifest_table_name)
+    manifest.create_table()
+    for table_name, columns_dict in config.table_info.items():
+        postgre.create_table(table_name, columns_dict, if_not_exists=True)
+        postgre.create_unique_index(table_name, config.table_keys.get(table_name))
+
+    with metrics.stage('find_pending_files') as stage:
+        song_entries = manifest.pending_files(list_json_files(songs_filepath))
+        log_entries = manifest.pending_files(list_json_files(logs_filepath))
+        stage.rows_out = len(song_entries) + len(log_entries)
+    if not song_entries and not log_entries:
+        logger.info("No new or changed files, nothing to load")
+        return
+
+    with metrics.stage('read_songs', bytes=sum(entry['size'] for entry in song_entries)) as stage:
+        songs_df = get_json_dataframe(songs_filepath, files=[entry['path'] for entry in song_entries],
+                                      dtypes=column_dtypes(config), workers=config.reader_workers)
+        stage.rows_out = songs_df.shape[0]
+    with metrics.stage('read_logs', bytes=sum(entry['size'] for entry in log_entries)) as stage:
+        logs_df = get_json_dataframe(logs_filepath, files=[entry['path'] for entry in log_entries], dtypes=column_dtypes(config),
+                                     columns=config.log_columns, where=config.log_filter, workers=config.reader_workers)
+        stage.rows_out = logs_df.shape[0]
+    for table_name, table_df in build_dimension_tables(songs_df, logs_df, config).items():
+        with metrics.stage(f'upsert_{table_name}', rows_in=table_df.shape[0]) as stage:
+            stage.rows_out = postgre.upsert_dataframe(table_df, table_name, config.table_keys.get(table_name),
+                                                      columns_dict=config.table_info.get(table_name),
+                                                      binary=table_name in config.binary_copy_tables)
+
+    if not logs_df.empty:
+        with metrics.stage('match_songs', rows_in=logs_df.shape[0]) as stage:
+            song_artist_ids = match_in_database(postgre, logs_df, config.songs_table_name, config.artists_table_name)
+            stage.rows_out = int(song_artist_ids['song_id'].notna().sum())
+        with metrics.stage(f'upsert_{config.songsplay_table_name}', rows_in=logs_df.shape[0]) as stage:
+            songplay_df = build_songplay_table(logs_df, song_artist_ids, config)
+            stage.rows_out = postgre.upsert_dataframe(songplay_df, config.songsplay_table_name,
+                                                      config.table_keys.get(config.songsplay_table_name),
+                                                      columns_dict=config.table_info.get(config.songsplay_table_name),
+                                                      binary=config.songsplay_table_name in config.binary_copy_tables)
+    manifest.record(song_entries + log_entries)
+
+def main(incremental:bool=False, engine:str='pandas', metrics_paths:list=('etl_metrics.json',), profile:str=None,
+         profile_dir:str=None, max_memory_mb:int=None, spill_dir:str=None, pipelined:bool=False, queue_depth:int=2,
+         writers:int=1):
+    """
+    Run the Sparkify ETL.
+    Argument:
+        - incremental {bool} - load only new or changed files instead of a full reload (pandas engine only)
+        - engine {str} - `pandas` transforms in Python, `sql` stages the raw data and transforms inside Postgres
+        - metrics_paths {list} - files the per stage metrics are written to, `.prom` ones as Prometheus textfiles
+        - profile {str} - profile every stage with the `auto`, `sampling` or `cprofile` profiler, None to not profile
+        - profile_dir {str} - directory of the profiles, defaults to `profile` next to the first metrics file
+        - max_memory_mb {int} - process the logs in chunks within this memory budget (pandas full reload only)
+        - spill_dir {str} - directory the out-of-core mode spills partitions to, a temporary directory by default
+        - pipelined {bool} - overlap parsing, transformation and COPY of the logs (pandas full reload only)
+        - queue_depth {int} - log chunks buffered between two pipeline stages
+        - writers {int} - concurrent COPY writers of the pipeline
+    """
+    start = time.perf_counter()
+    profiler = None
+    if profile:
+        profiler = StageProfiler(profile_dir or os.path.join(os.path.dirname(metrics_paths[0]), 'profile'), mode=profile)
+    metrics = RunMetrics('sparkify_postgres', labels={'engine': engine, 'mode': 'incremental' if incremental else 'full'},
+                         profiler=profiler)
     sparkifydb = 'sparkifydb'
-    Postgre('studentdb').create_database(sparkifydb)
-    postgre = Postgre(sparkifydb)
     config = Config()
+    if profiler:
+        # The stage profilers only sample this process, the readers parse in it instead of in a process pool
+        config.reader_workers = 1
+    if not incremental:
+        Postgre('studentdb').create_database(sparkifydb)
+    # Every pipeline writer holds a pooled connection while it copies a chunk
+    postgre = Postgre(sparkifydb, max_connections=max(config.max_concurrent_loads, writers if pipelined else 1))
     
     songs_filepath = "./data/song_data"
-    songs_data =[json_data for json_data in get_json_data(songs_filepath) if json_data]
-    songs_df = pd.DataFrame.from_dict(songs_data)
-    
     logs_filepath = "./data/log_data"
-    logs_data =[json_data for json_data in get_json_data(logs_filepath) if json_data]
-    logs_df = pd.DataFrame.from_dict(logs_data)
-    
-    songs_column_names = list(config.table_info.get(config.songs_table_name).keys())
-    song_selected_df = songs_df[songs_column_names]
-    postgre.create_table(table_name=config.songs_table_name, columns_dict=config.table_info.get(config.songs_table_name))
-    
-    artists_column_names = list(config.table_info.get(config.artists_table_name).keys())
-    artist_df = songs_df[artists_column_names]
-    postgre.create_table(table_name=config.artists_table_name, columns_dict=config.table_info.get(config.artists_table_name))
-    
-    time_df = logs_df[logs_df['page'] == 'NextSong'].reset_index(drop=True)
-    time_df = time_df.apply(lambda x: convert_timestamp(x) if x.name == 'ts' else x)
-    time_data = (time_df.ts, time_df.ts.dt.hour, time_df.ts.dt.day, time_df.ts.dt.week, time_df.ts.dt.month, time_df.ts.dt.year, time_df.ts.dt.weekday)
-    column_labels = ('timestamp', 'hour', 'day', 'week', 'month', 'year', 'weekday')
-    time_dict = []
-    for index in range(0, len(time_data[0])):
-        time_dict.append({key:value for key, value in zip(column_labels, (entry[index] for entry in time_data))})
-    time_df = pd.DataFrame(time_dict)
-    time_column_names = list(config.table_info.get(config.time_table_name).keys())
-    postgre.create_table(table_name=config.time_table_name, columns_dict=config.table_info.get(config.time_table_name))
-    
-    users_column_names = list(config.table_info.get(config.users_table_name).keys())
-    user_df = logs_df[users_column_names]
-    postgre.create_table(table_name=config.users_table_name, columns_dict=config.table_info.get(config.users_table_name))
-    
-    tables_dataframes ={
-        config.songs_table_name: song_selected_df,
-        config.artists_table_name: artist_df,
-        config.time_table_name: time_df,
-        config.users_table_name: user_df
-        }
-    for table_name, table_df in tables_dataframes.items():
-        postgre.create_table(table_name=table_name, columns_dict=config.table_info.get(table_name))
-        postgre.copy_dataframe_to_table(table_df, table_name)
-        
-    logs_df[['song_id', 'artist_id']] = logs_df.apply(lambda row: pd.Series(get_song_artist_id(postgre, 
-                                                                                               row['song'], 
-                                                                                               row['artist'], 
-                                                                                               row['length'], 
-                                                                                               config)
-                                                                           ), 
-                                                      axis=1)
-    songplay_column_names = list(config.table_info.get(config.songsplay_table_name).keys())
-    songplay_df = logs_df[songplay_column_names]
-    postgre.create_table(table_name=config.songsplay_table_name, columns_dict=config.table_info.get(config.songsplay_table_name))
-    postgre.copy_dataframe_to_table(songplay_df, config.songsplay_table_name)
+    if engine == 'sql':
+        SqlEngine(postgre, config, metrics=metrics).run(songs_filepath, logs_filepath)
+    elif incremental:
+        load_incremental(postgre, config, songs_filepath, logs_filepath, metrics)
+    elif pipelined:
+        load_pipelined(postgre, config, songs_filepath, logs_filepath, metrics, queue_depth, writers, max_memory_mb)
+    elif max_memory_mb:
+        load_out_of_core(postgre, config, songs_filepath, logs_filepath, max_memory_mb, metrics, spill_dir)
+    else:
+        load_full(postgre, config, songs_filepath, logs_filepath, metrics)
     
-    postgre.conn.close()
+    postgre.log_statement_cache_stats()
+    postgre.close_connectiion()
+    metrics.write(*metrics_paths)
+    if profiler:
+        profiler.write_summary()
+    logger.info(f"Sparkify ETL ({engine} engine) completed in {time.perf_counter() - start:.2f}s")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Sparkify ETL loading the raw JSON data to the Postgres star schema")
+    parser.add_argument('--incremental', action='store_true',
+                        help="load only new or changed files into the existing tables instead of a full reload")
+    parser.add_argument('--engine', choices=['pandas', 'sql'], default='pandas',
+                        help="transform in pandas, or stage the raw data and transform inside Postgres")
+    parser.add_argument('--metrics', nargs='+', default=['etl_metrics.json'],
+                        help="files to write the per stage metrics to, .prom files in the Prometheus textfile format")
+    parser.add_argument('--profile', nargs='?', const='auto', choices=['auto', 'sampling', 'cprofile'],
+                        help="profile every stage, with a sampling profiler or cProfile where sampling is unavailable")
+    parser.add_argument('--profile-dir', default=None,
+                        help="directory of the collapsed stacks and hotspot summary, defaults to profile/ next to the metrics")
+    parser.add_argument('--max-memory', type=int, default=None, metavar='MB',
+                        help="process the logs in chunks within this memory budget, spilling to disk, for data larger than RAM")
+    parser.add_argument('--spill-dir', default=None, help="directory of the partitions spilled by --max-memory")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="overlap the parsing, transformation and COPY of the logs with bounded queues")
+    parser.add_argument('--queue-depth', type=int, default=2, help="log chunks buffered between two pipeline stages")
+    parser.add_argument('--writers', type=int, default=1, help="concurrent COPY writers of the pipeline")
+    args = parser.parse_args()
+    if args.writers < 1:
+        parser.error("--writers must be at least 1")
+    if args.incremental and args.engine != 'pandas':
+        parser.error("--incremental is only supported by the pandas engine")
+    if args.max_memory and (args.incremental or args.engine != 'pandas'):
+        parser.error("--max-memory is only supported by the full reload of the pandas engine")
+    if args.pipeline and (args.incremental or args.engine != 'pandas'):
+        parser.error("--pipeline is only supported by the full reload of the pandas engine")
+    main(incremental=args.incremental, engine=args.engine, metrics_paths=args.metrics, profile=args.profile,
+         profile_dir=args.profile_dir, max_memory_mb=args.max_memory, spill_dir=args.spill_dir, pipelined=args.pipeline,
+         queue_depth=args.queue_depth, writers=args.writers)
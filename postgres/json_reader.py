@@ -0,0 +1,305 @@
+import io
+import os
+import json
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+NDJSON = 'ndjson'
+JSON = 'json'
+
+
+def list_json_files(filepath: str):
+    """
+    Return all JSON files found under a directory, walking it recursively.
+    Argument:
+        - filepath {str} - root directory
+    Return:
+        {list} - sorted absolute file paths
+    """
+    json_files = []
+    for root, dirs, files in os.walk(filepath):
+        json_files.extend(os.path.abspath(os.path.join(root, file)) for file in files if file.endswith('.json'))
+    return sorted(json_files)
+
+
+def sniff_format(first_line: str):
+    """
+    Decide from the first line of a file whether it is newline delimited JSON
+    (one document per line) or a single, possibly multi line, JSON document.
+    """
+    stripped = first_line.strip()
+    if not stripped.startswith('{'):
+        return JSON
+    try:
+        json.loads(stripped)
+        return NDJSON
+    except ValueError:
+        return JSON
+
+
+def _first_content_line(file_object):
+    """Return the first non blank line of a binary file, decoded, or '' at the end of the file."""
+    line = file_object.readline()
+    while line and not line.strip():
+        line = file_object.readline()
+    return line.decode('utf-8', errors='replace')
+
+
+class _TextReader(object):
+    """Minimal utf-8 line reader over a binary file keeping byte offsets for `tell`."""
+
+    def __init__(self, file_object):
+        self.file_object = file_object
+
+    def readline(self):
+        return self.file_object.readline().decode('utf-8')
+
+    def tell(self):
+        return self.file_object.tell()
+
+
+class RecordFilter(object):
+    """
+    Column projection and row predicate applied to every record while it is parsed.
+
+    `where` maps a field to the values it may take; records failing any field are dropped, and
+    only the `columns` of the kept records are returned, missing fields as None. For NDJSON,
+    lines that cannot contain an accepted value (its JSON text is not a substring of the line)
+    are skipped before they are parsed at all. Instances are sent to the reader processes,
+    so the predicate is declarative rather than a callable.
+
+    Example:
+        RecordFilter(columns=['ts', 'userId', 'page'], where={'page': ['NextSong']})
+    """
+
+    def __init__(self, columns: list = None, where: dict = None):
+        self.columns = list(columns) if columns else None
+        self.where = {field: frozenset(values) for field, values in (where or {}).items()}
+        self.markers = [markers for markers in (self._markers(values) for values in self.where.values()) if markers]
+
+    @staticmethod
+    def _markers(values):
+        """
+        JSON texts of the accepted values of one field, empty when a value could be written
+        in more than one way (non ASCII or escaped characters) and lines cannot be prefiltered.
+        """
+        markers = []
+        for value in values:
+            if not isinstance(value, str) or not value.isascii() or not value.isprintable() or '"' in value \
+                    or '\\' in value:
+                return []
+            markers.append(json.dumps(value))
+        return markers
+
+    def skip_line(self, line: str):
+        return any(not any(marker in line for marker in markers) for markers in self.markers)
+
+    def apply(self, record: dict):
+        """
+        Return:
+            {dict} - the projected record, None when it fails the predicate
+        """
+        for field, values in self.where.items():
+            if record.get(field) not in values:
+                return None
+        if self.columns is None:
+            return record
+        return {column: record.get(column) for column in self.columns}
+
+    def apply_all(self, records: list):
+        return [record for record in map(self.apply, records) if record is not None]
+
+
+def _read_ndjson_lines(file_object, end: int = None, record_filter: RecordFilter = None):
+    records = []
+    invalid = 0
+    while end is None or file_object.tell() <= end:
+        line = file_object.readline()
+        if not line:
+            break
+        if not line.strip():
+            continue
+        if record_filter and record_filter.skip_line(line):
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            invalid += 1
+            continue
+        if record_filter:
+            record = record_filter.apply(record)
+            if record is None:
+                continue
+        records.append(record)
+    return records, invalid
+
+
+def read_segment(path: str, start: int = 0, end: int = None, record_filter: RecordFilter = None):
+    """
+    Read the records of one file, or of the byte range [start, end] of a NDJSON file.
+    The file format is sniffed from the first non blank line and the file is read only once;
+    a file that is not a valid single document either is read line by line.
+    A range not starting at 0 skips the partial line it starts in, a range reads
+    the whole line it ends in, so consecutive ranges yield every line exactly once.
+    Arguments:
+        - path {str} - JSON file path
+        - start {int} - first byte of the range
+        - end {int} - last byte of the range, None reads to the end of the file
+        - record_filter {RecordFilter} - projection and predicate applied while parsing
+    Return:
+        {tuple} - list of records, number of invalid lines skipped
+    """
+    with open(path, 'rb') as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()
+            return _read_ndjson_lines(_TextReader(f), end, record_filter)
+
+        first_line = _first_content_line(f)
+        if sniff_format(first_line) == NDJSON:
+            records = [json.loads(first_line)]
+            if record_filter:
+                records = record_filter.apply_all(records)
+            more_records, invalid = _read_ndjson_lines(_TextReader(f), end, record_filter)
+            return records + more_records, invalid
+
+        text = first_line + f.read().decode('utf-8')
+        if not text.strip():
+            logger.warning(f"Skipping {path}: empty file")
+            return [], 1
+        try:
+            document = json.loads(text)
+        except ValueError:
+            # Not a single document, most likely NDJSON whose first line is broken:
+            # keep the valid lines and count only the others as invalid
+            records, invalid = _read_ndjson_lines(io.StringIO(text), record_filter=record_filter)
+            logger.warning(f"{path} is not a single JSON document, read {len(records)} records line by line "
+                           f"and skipped {invalid} invalid lines")
+            return records, invalid
+        records = document if isinstance(document, list) else [document]
+        return (record_filter.apply_all(records) if record_filter else records), 0
+
+
+def read_segments(segments: list, record_filter: RecordFilter = None):
+    """
+    Read a group of (path, start, end) segments. Entry point of the pool workers.
+    Return:
+        {tuple} - list of records, number of invalid lines skipped
+    """
+    records, invalid = [], 0
+    for path, start, end in segments:
+        segment_records, segment_invalid = read_segment(path, start, end, record_filter)
+        records.extend(segment_records)
+        invalid += segment_invalid
+    return records, invalid
+
+
+class JsonReader(object):
+    """
+    Reads JSON and NDJSON files with a process pool, yielding batches of records.
+
+    Small files are grouped into tasks of roughly `chunk_bytes` (less for inputs smaller
+    than `chunk_bytes` per worker), larger files are split in byte ranges, so both the thousands of single record
+    song files and the large event log files are spread evenly across the workers.
+    With `columns` and `where` (see `RecordFilter`) the workers drop unneeded fields and
+    records while parsing, so only the projected, matching records ever reach the caller.
+
+    Example:
+        reader = JsonReader(workers=4, batch_size=50000, columns=['ts', 'page'], where={'page': ['NextSong']})
+        for batch in reader.iter_batches('./data/log_data'):
+            df = pd.DataFrame.from_records(batch)
+    """
+
+    def __init__(self, workers: int = None, batch_size: int = 50000, chunk_bytes: int = 32 * 1024 * 1024,
+                 columns: list = None, where: dict = None, max_pending_tasks: int = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.chunk_bytes = chunk_bytes
+        self.max_pending_tasks = max_pending_tasks or 2 * self.workers
+        self.record_filter = RecordFilter(columns, where) if columns or where else None
+
+    def plan_tasks(self, files: list):
+        """
+        Group files and byte ranges of large files into tasks of about `chunk_bytes`, or of the
+        total size divided by the number of workers when smaller, so a few MB of tiny files are
+        still spread across every worker instead of forming a single task.
+        Return:
+            {list} - list of tasks, each a list of (path, start, end) segments
+        """
+        sizes = [(path, os.path.getsize(path)) for path in files]
+        task_bytes = max(1, min(self.chunk_bytes, -(-sum(size for _, size in sizes) // self.workers)))
+        tasks, current, current_size = [], [], 0
+        for path, size in sizes:
+            if size > task_bytes and self._is_ndjson(path):
+                for start in range(0, size, task_bytes):
+                    tasks.append([(path, start, min(start + task_bytes, size) - 1)])
+                continue
+            current.append((path, 0, None))
+            current_size += size
+            if current_size >= task_bytes:
+                tasks.append(current)
+                current, current_size = [], 0
+        if current:
+            tasks.append(current)
+        return tasks
+
+    @staticmethod
+    def _is_ndjson(path: str):
+        with open(path, 'rb') as f:
+            return sniff_format(_first_content_line(f)) == NDJSON
+
+    def _iter_task_results(self, tasks: list):
+        if self.workers == 1 or len(tasks) == 1:
+            for task in tasks:
+                yield read_segments(task, self.record_filter)
+            return
+        # Submit tasks as results are consumed, so at most `max_pending_tasks` parsed tasks
+        # are held in memory however slowly the caller processes the batches.
+        tasks = iter(tasks)
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque(executor.submit(read_segments, task, self.record_filter)
+                            for _, task in zip(range(self.max_pending_tasks), tasks))
+            while pending:
+                result = pending.popleft().result()
+                task = next(tasks, None)
+                if task is not None:
+                    pending.append(executor.submit(read_segments, task, self.record_filter))
+                yield result
+
+    def iter_batches(self, filepath: str):
+        """
+        Yield lists of at most `batch_size` records read from every JSON file under filepath.
+        Argument:
+            - filepath {str} - root directory of the JSON files
+        """
+        yield from self.iter_file_batches(list_json_files(filepath), filepath)
+
+    def iter_file_batches(self, files: list, label: str = 'files'):
+        """
+        Yield lists of at most `batch_size` records read from the given JSON files.
+        Arguments:
+            - files {list} - JSON file paths
+            - label {str} - name of the file set used in log messages
+        """
+        tasks = self.plan_tasks(files)
+        logger.info(f"Reading {len(files)} JSON files from {label} in {len(tasks)} tasks "
+                    f"with {self.workers} workers")
+        batch, total_invalid = [], 0
+        for records, invalid in self._iter_task_results(tasks):
+            total_invalid += invalid
+            batch.extend(records)
+            while len(batch) >= self.batch_size:
+                yield batch[:self.batch_size]
+                del batch[:self.batch_size]
+        if batch:
+            yield batch
+        if total_invalid:
+            logger.warning(f"Skipped {total_invalid} invalid JSON lines or files under {label}")
+
+    def iter_records(self, filepath: str):
+        for batch in self.iter_batches(filepath):
+            yield from batch
@@ -0,0 +1,104 @@
+import os
+import hashlib
+import logging
+
+from postgre import Postgre
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def file_hash(path: str, block_size: int = 1024 * 1024):
+    """
+    Return the sha256 hex digest of a file, read in blocks of `block_size` bytes.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileManifest(object):
+    """
+    Manifest table of the raw files already loaded into the star schema.
+
+    Every processed file is recorded with its path, size, modification time and content hash.
+    A file is pending when it is not in the manifest, or when its size or modification time
+    changed and its content hash no longer matches; unchanged files are skipped without hashing.
+
+    Example:
+        manifest = FileManifest(postgre)
+        manifest.create_table()
+        pending = manifest.pending_files(list_json_files('./data/log_data'))
+        ... load the pending files ...
+        manifest.record(pending)
+    """
+    COLUMNS = {'path': 'TEXT PRIMARY KEY',
+               'size': 'BIGINT',
+               'mtime': 'DOUBLE PRECISION',
+               'content_hash': 'CHAR(64)',
+               'processed_at': 'TIMESTAMP DEFAULT now()'}
+
+    def __init__(self, postgre: Postgre, table_name: str = 'etl_manifest'):
+        self.postgre = postgre
+        self.table_name = table_name
+
+    def create_table(self):
+        return self.postgre.create_table(self.table_name, self.COLUMNS, if_not_exists=True)
+
+    def processed_files(self):
+        """
+        Return:
+            {dict} - path to its manifest entry
+        """
+        query = f"""SELECT path, size, mtime, content_hash FROM {self.table_name};"""
+        return {entry['path']: entry for entry in self.postgre.execute_prepared(query, results=True) or []}
+
+    @staticmethod
+    def file_entries(files: list):
+        """
+        Return:
+            {list} - dicts with path, size and mtime of the given files
+        """
+        entries = []
+        for path in files:
+            stat = os.stat(path)
+            entries.append({'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime})
+        return entries
+
+    def pending_files(self, files: list):
+        """
+        Return the manifest entries of the files that are new or changed since they were processed.
+        Arguments:
+            - files {list} - candidate file paths
+        Return:
+            {list} - dicts with path, size, mtime and content_hash of the pending files
+        """
+        processed = self.processed_files()
+        pending, touched = [], []
+        for entry in self.file_entries(files):
+            path = entry['path']
+            previous = processed.get(path)
+            if previous and previous['size'] == entry['size'] and previous['mtime'] == entry['mtime']:
+                continue
+            entry['content_hash'] = file_hash(path)
+            if previous and previous['content_hash'] == entry['content_hash']:
+                touched.append(entry)
+                continue
+            pending.append(entry)
+
+        if touched:
+            self.record(touched)
+        logger.info(f"Manifest {self.table_name}: {len(pending)} of {len(files)} files new or changed")
+        return pending
+
+    def record(self, entries: list):
+        """
+        Record processed files in the manifest, updating the entries of files seen before.
+        """
+        entries = [{**entry, 'content_hash': entry.get('content_hash') or file_hash(entry['path'])}
+                   for entry in entries]
+        return self.postgre.insert_records(self.table_name, entries,
+                                           columns=['path', 'size', 'mtime', 'content_hash'],
+                                           key_columns=['path'])
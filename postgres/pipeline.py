@@ -0,0 +1,134 @@
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class StageCounter(object):
+    """
+    Throughput counters of one pipeline stage. `busy_seconds` is the time spent working on items,
+    `idle_seconds` the time spent waiting for input (starved) or for room downstream (backpressure).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.rows = 0
+        self.busy_seconds = 0.0
+        self.idle_seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.busy_seconds if self.busy_seconds else 0.0
+
+    def to_dict(self):
+        return {'stage': self.name, 'items': self.items, 'rows': self.rows, 'busy_seconds': self.busy_seconds,
+                'idle_seconds': self.idle_seconds, 'rows_per_second': self.rows_per_second}
+
+    def log(self):
+        logger.info(f"Pipeline {self.name}: {self.items} items, {self.rows} rows, {self.rows_per_second:.0f} rows/s, "
+                    f"busy {self.busy_seconds:.2f}s, idle {self.idle_seconds:.2f}s")
+
+
+class AsyncPipeline(object):
+    """
+    Reader -> transformer -> writer pipeline on asyncio, so parsing, transforming and COPY overlap.
+
+    The three stages are connected by bounded queues of `queue_depth` items: a stage that gets
+    ahead blocks on a full queue (backpressure), so at most about `2 * queue_depth` items are in
+    flight. The blocking work of every stage (advancing the source iterator, the transform
+    function and the sink function) runs in a thread pool, and `writers` sinks consume the
+    transformed items concurrently, each typically over its own pooled connection.
+
+    Example:
+        pipeline = AsyncPipeline(reader.iter_batches(path), transform_batch, copy_tables, queue_depth=2)
+        counters = pipeline.run()
+    Arguments:
+        - source {iterable} - items to process, iterated from a worker thread
+        - transform {callable} - item -> transformed item
+        - sink {callable} - transformed item -> number of rows written
+        - rows {callable} - item -> number of rows, for the reader and transformer counters
+    """
+    DONE = object()
+
+    def __init__(self, source, transform, sink, queue_depth: int = 2, writers: int = 1, rows=len):
+        self.source = source
+        self.transform = transform
+        self.sink = sink
+        self.queue_depth = queue_depth
+        self.writers = writers
+        self.rows = rows
+        self.counters = {name: StageCounter(name) for name in ('reader', 'transformer', 'writer')}
+
+    async def _in_thread(self, counter: StageCounter, function, *args):
+        start = time.perf_counter()
+        result = await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        counter.busy_seconds += time.perf_counter() - start
+        return result
+
+    @staticmethod
+    async def _timed(counter: StageCounter, awaitable):
+        start = time.perf_counter()
+        result = await awaitable
+        counter.idle_seconds += time.perf_counter() - start
+        return result
+
+    async def _read(self, output_queue: asyncio.Queue):
+        counter = self.counters['reader']
+        iterator = iter(self.source)
+        while True:
+            item = await self._in_thread(counter, next, iterator, self.DONE)
+            if item is self.DONE:
+                break
+            counter.items += 1
+            counter.rows += self.rows(item)
+            await self._timed(counter, output_queue.put(item))
+        await output_queue.put(self.DONE)
+
+    async def _transform(self, input_queue: asyncio.Queue, output_queue: asyncio.Queue):
+        counter = self.counters['transformer']
+        while True:
+            item = await self._timed(counter, input_queue.get())
+            if item is self.DONE:
+                break
+            counter.rows += self.rows(item)
+            result = await self._in_thread(counter, self.transform, item)
+            counter.items += 1
+            await self._timed(counter, output_queue.put(result))
+        for _ in range(self.writers):
+            await output_queue.put(self.DONE)
+
+    async def _write(self, input_queue: asyncio.Queue):
+        counter = self.counters['writer']
+        while True:
+            item = await self._timed(counter, input_queue.get())
+            if item is self.DONE:
+                break
+            # Awaited before the addition, which would otherwise read `rows` before another writer updates it
+            rows = await self._in_thread(counter, self.sink, item)
+            counter.rows += rows or 0
+            counter.items += 1
+
+    async def run_async(self):
+        parsed = asyncio.Queue(maxsize=self.queue_depth)
+        transformed = asyncio.Queue(maxsize=self.queue_depth)
+        await asyncio.gather(self._read(parsed), self._transform(parsed, transformed),
+                             *(self._write(transformed) for _ in range(self.writers)))
+
+    def run(self):
+        """
+        Run the pipeline to completion. An exception in any stage cancels the others and is raised.
+        Return:
+            {dict} - stage name to its `StageCounter`
+        """
+        self.executor = ThreadPoolExecutor(max_workers=2 + self.writers, thread_name_prefix='pipeline')
+        try:
+            asyncio.run(self.run_async())
+        finally:
+            self.executor.shutdown()
+        for counter in self.counters.values():
+            counter.log()
+        return self.counters
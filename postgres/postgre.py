@@ -1,8 +1,22 @@
 import psycopg2
 from  psycopg2 import ProgrammingError, DatabaseError
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import execute_values
+import re
+import copy
+import time
+import uuid
 import logging
+import weakref
+import threading
+import numpy as np
 import pandas as pd
-from io import StringIO
+from contextlib import contextmanager
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pgcopy
+import copy_text
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -15,26 +29,238 @@ class Connection(object):
     def __init__(self, database_name:str):
         self.database_name = database_name
            
+    @property
+    def dsn(self):
+        return f"host={self.HOST} dbname={self.database_name} user={self.USER} password={self.PASSWORD}"
+
     def establish_connection(self, auto_commit:bool = True):
-        conn = psycopg2.connect(f"host={self.HOST} dbname={self.database_name} user={self.USER} password={self.PASSWORD}")
+        conn = psycopg2.connect(self.dsn)
         conn.set_session(autocommit=auto_commit)
         logger.info(f"Connection Established to: {self.database_name}")
         return conn
 
+    def create_pool(self, max_connections:int, min_connections:int = 1):
+        pool = ThreadedConnectionPool(min_connections, max_connections, self.dsn)
+        logger.info(f"Connection Pool of up to {max_connections} connections Established to: {self.database_name}")
+        return pool
+
+class PreparedStatementCache(object):
+    """
+    LRU cache of the statements prepared on one connection.
+
+    Queries are written with psycopg2 `%s` placeholders. The first execution of a query runs it as is,
+    as most queries only run once. A query executed again is PREPAREd server side (placeholders become
+    `$1..$n`), its later executions only EXECUTE the prepared statement with new bound values, skipping
+    parsing and planning. Once `max_statements` are prepared the least recently used one is DEALLOCATEd.
+    Hits and misses are counted per query text.
+    """
+    PLACEHOLDER = re.compile(r'%%|%s')
+
+    def __init__(self, max_statements:int = 64):
+        self.max_statements = max_statements
+        self.statements = OrderedDict()
+        self.stats = {}
+
+    @classmethod
+    def to_positional(cls, query:str):
+        """
+        Return the query with `%s` placeholders turned into `$1..$n` and the number of parameters.
+        """
+        count = 0
+
+        def replace(match):
+            nonlocal count
+            if match.group(0) == '%%':
+                return '%'
+            count += 1
+            return f"${count}"
+
+        return cls.PLACEHOLDER.sub(replace, query), count
+
+    def prepare(self, cursor, query:str):
+        stats = self.stats.setdefault(query, {'hits': 0, 'misses': 0})
+        if query in self.statements:
+            self.statements.move_to_end(query)
+            stats['hits'] += 1
+            return self.statements[query]
+
+        stats['misses'] += 1
+        if len(self.statements) >= self.max_statements:
+            _, (evicted_name, _) = self.statements.popitem(last=False)
+            cursor.execute(f"DEALLOCATE {evicted_name};")
+        positional_query, number_params = self.to_positional(query)
+        statement_name = f"stmt_{uuid.uuid4().hex}"
+        cursor.execute(f"PREPARE {statement_name} AS {positional_query}")
+        self.statements[query] = (statement_name, number_params)
+        return self.statements[query]
+
+    def execute(self, cursor, query:str, params:tuple = ()):
+        if query not in self.stats:
+            self.stats[query] = {'hits': 0, 'misses': 1}
+            cursor.execute(query, tuple(params))
+            return
+        statement_name, number_params = self.prepare(cursor, query)
+        if number_params:
+            cursor.execute(f"EXECUTE {statement_name} ({', '.join(['%s'] * number_params)});", tuple(params))
+        else:
+            cursor.execute(f"EXECUTE {statement_name};")
+
+
+class ChunkedStream(object):
+    """
+    Read only file like object over the chunks produced by `_iter_chunks`.
+    Only the chunk being read is held in memory. Subclasses set EMPTY and NEWLINE
+    to the str or bytes flavour of the chunks they produce.
+    """
+    EMPTY = ''
+    NEWLINE = '\n'
+
+    def __init__(self):
+        self.rows = 0
+        self._chunks = self._iter_chunks()
+        self._buffer = self.EMPTY
+        self._offset = 0
+        self._exhausted = False
+
+    def _iter_chunks(self):
+        raise NotImplementedError
+
+    def _fill(self, size: int):
+        while (size < 0 or len(self._buffer) - self._offset < size) and not self._exhausted:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._exhausted = True
+                break
+            self._buffer = self._buffer[self._offset:] + chunk
+            self._offset = 0
+
+    def read(self, size: int = -1):
+        self._fill(size)
+        end = len(self._buffer) if size < 0 else self._offset + size
+        data = self._buffer[self._offset:end]
+        self._offset += len(data)
+        return data
+
+    def readline(self, size: int = -1):
+        while self.NEWLINE not in self._buffer[self._offset:] and not self._exhausted:
+            self._fill(len(self._buffer) - self._offset + 1)
+        newline = self._buffer.find(self.NEWLINE, self._offset)
+        end = len(self._buffer) if newline == -1 else newline + 1
+        if size >= 0:
+            end = min(end, self._offset + size)
+        data = self._buffer[self._offset:end]
+        self._offset += len(data)
+        return data
+
+
+class DataFrameCopyStream(ChunkedStream):
+    """
+    File like object streaming a DataFrame as COPY text, `chunk_size` rows at a time.
+    Each chunk is encoded column by column with `copy_text.encode_dataframe`, missing values
+    as `\\N`. Only one serialized chunk is held in memory, so feeding it to `cursor.copy_expert`
+    loads a table with roughly constant extra memory. The number of rows streamed
+    so far is kept in `rows`.
+    Arguments:
+        - df {pd.DataFrame} - DataFrame to stream
+        - chunk_size {int} - number of rows serialized at a time
+        - sep {str} - field delimiter
+    """
+
+    def __init__(self, df: pd.DataFrame, chunk_size: int = 100000, sep: str = '\t'):
+        self.df = df
+        self.chunk_size = chunk_size
+        self.sep = sep
+        super().__init__()
+
+    def _iter_chunks(self):
+        for start in range(0, self.df.shape[0], self.chunk_size):
+            chunk = self.df.iloc[start:start + self.chunk_size]
+            self.rows += chunk.shape[0]
+            yield copy_text.encode_dataframe(chunk, self.sep)
+
+
+class BinaryCopyStream(ChunkedStream):
+    """
+    File like object streaming a DataFrame in the PGCOPY binary format, `chunk_size` rows at a time.
+    Wire types are picked from the table column definitions, see `pgcopy.encode_rows`.
+    Arguments:
+        - df {pd.DataFrame} - DataFrame to stream
+        - columns_dict {dict} - column name to SQL type definition, as in `Config.table_info`
+        - chunk_size {int} - number of rows encoded at a time
+    """
+    EMPTY = b''
+    NEWLINE = b'\n'
+
+    def __init__(self, df: pd.DataFrame, columns_dict: dict, chunk_size: int = 100000):
+        self.df = df
+        self.columns_dict = columns_dict
+        self.chunk_size = chunk_size
+        super().__init__()
+
+    def _iter_chunks(self):
+        yield pgcopy.PGCOPY_HEADER
+        for start in range(0, self.df.shape[0], self.chunk_size):
+            chunk = self.df.iloc[start:start + self.chunk_size]
+            self.rows += chunk.shape[0]
+            yield pgcopy.encode_rows(chunk, self.columns_dict)
+        yield pgcopy.PGCOPY_TRAILER
+
+
 class Postgre(object):
     
-    def __init__(self, database_name:str):
+    def __init__(self, database_name:str, max_connections:int = 4):
         self.connection = Connection(database_name)
         self.conn = self.connection.establish_connection()
+        self.max_connections = max_connections
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        self.max_prepared_statements = 64
+        # Keyed on the connection objects, so the caches of closed pooled connections go away with them
+        self._statement_caches = weakref.WeakKeyDictionary()
     
     @staticmethod
     def _get_results_dict(column_names:list, list_records:list):
         return [{key:value for key, value in zip(column_names, entry)} for entry in list_records] 
     
     def close_connectiion(self):
+        self._statement_caches.clear()
         if self.conn:
             logger.info('Closing Connection')
             self.conn.close()
+        if self.pool:
+            logger.info('Closing Connection Pool')
+            self.pool.closeall()
+            self.pool = None
+
+    def get_pool(self):
+        with self._pool_lock:
+            if self.pool is None:
+                self.pool = self.connection.create_pool(self.max_connections)
+        return self.pool
+
+    @contextmanager
+    def pooled_connection(self, auto_commit:bool = True):
+        """
+        Borrow a connection from the pool, returning it once the block exits.
+        Broken connections are discarded instead of being returned to the pool.
+        """
+        pool = self.get_pool()
+        conn = pool.getconn()
+        try:
+            if conn.autocommit != auto_commit:
+                conn.set_session(autocommit=auto_commit)
+            yield conn
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+
+    def with_connection(self, conn):
+        """
+        Return a copy of this Postgre running its helpers over another connection.
+        """
+        postgre = copy.copy(self)
+        postgre.conn = conn
+        return postgre
         
 
     def _execute_query(self, query:str, results:bool = False):    
@@ -58,6 +284,100 @@ class Postgre(object):
             
             
             
+    @staticmethod
+    def _format_batch(rows:list, column_names:list, output:str, row_type=None):
+        if output == 'tuples':
+            return rows
+        if output == 'rows':
+            return [row_type._make(row) for row in rows]
+        if output == 'numpy':
+            return {column: np.array([row[index] for row in rows])
+                    for index, column in enumerate(column_names)}
+        return pd.DataFrame.from_records(rows, columns=column_names)
+
+    def stream_query(self, query:str, params=None, itersize:int=10000, output:str='tuples'):
+        """
+        Stream the results of a query in batches of `itersize` rows through a named, server side cursor,
+        so only one batch is held in memory at a time. The query runs on its own pooled connection,
+        inside a read transaction that is rolled back once the results are consumed or the generator is closed.
+        Arguments:
+            - query {str} - SELECT statement, optionally with `%s` placeholders
+            - params {tuple} - values bound to the placeholders
+            - itersize {int} - rows fetched from the server per round trip and per batch
+            - output {str} - batch format: `tuples` (list of tuples), `rows` (list of named tuples),
+              `numpy` (dict of column arrays) or `pandas` (DataFrame)
+        Return:
+            {generator} - result batches
+        Example:
+            for chunk in postgre.stream_query("SELECT * FROM songplays", output='pandas'):
+                ...
+        """
+        if output not in ('tuples', 'rows', 'numpy', 'pandas'):
+            raise ValueError(f"Unknown output format `{output}`")
+        with self.pooled_connection(auto_commit=False) as conn:
+            cursor = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+            cursor.itersize = itersize
+            try:
+                cursor.execute(query, params)
+                column_names, row_type = None, None
+                while True:
+                    rows = cursor.fetchmany(itersize)
+                    if not rows:
+                        break
+                    if column_names is None:
+                        column_names = [desc[0] for desc in cursor.description]
+                        row_type = namedtuple('Row', column_names, rename=True)
+                    yield self._format_batch(rows, column_names, output, row_type)
+            finally:
+                cursor.close()
+                conn.rollback()
+
+    def _statement_cache(self):
+        cache = self._statement_caches.get(self.conn)
+        if cache is None:
+            cache = PreparedStatementCache(self.max_prepared_statements)
+            self._statement_caches[self.conn] = cache
+        return cache
+
+    def execute_prepared(self, query:str, params:tuple = (), results:bool = False):
+        """
+        Execute a parameterized query through the prepared statement cache of the current connection.
+        Values are bound, never formatted into the SQL, so they need no manual escaping.
+        Arguments:
+            - query {str} - statement with `%s` placeholders
+            - params {tuple} - values bound to the placeholders
+            - results {bool} - return the rows as a list of dicts
+        Return:
+            {list|bool} - rows when `results`, otherwise True, False if the execution failed
+        """
+        try:
+            cursor = self.conn.cursor()
+            self._statement_cache().execute(cursor, query, params)
+            if results:
+                return self._get_results_dict([desc[0] for desc in cursor.description], cursor.fetchall())
+            return True
+        except DatabaseError:
+            logger.exception("Prepared statement execution was not successful")
+            return False
+
+    def statement_cache_stats(self):
+        """
+        Return:
+            {dict} - query text to its prepared statement cache hits and misses, over every connection
+        """
+        stats = {}
+        for cache in list(self._statement_caches.values()):
+            for query, counts in cache.stats.items():
+                total = stats.setdefault(query, {'hits': 0, 'misses': 0})
+                total['hits'] += counts['hits']
+                total['misses'] += counts['misses']
+        return stats
+
+    def log_statement_cache_stats(self):
+        for query, counts in self.statement_cache_stats().items():
+            logger.info(f"Prepared statement {counts['hits']} hits / {counts['misses']} misses: "
+                        f"{' '.join(query.split())[:120]}")
+
     def create_database(self, database_name:str):
         query = f"""DROP DATABASE IF EXISTS {database_name};"""
         result = self._execute_query(query)
@@ -71,41 +391,380 @@ class Postgre(object):
         query = f"""DROP TABLE IF EXISTS {table_name};"""     
         result = self._execute_query(query)
         logger.info(f"Table {table_name} dropped: {result}")
+        return result
     
-    def create_table(self, table_name:str, columns_dict:dict):
-        self.drop_table(table_name)
+    def create_table(self, table_name:str, columns_dict:dict, if_not_exists:bool=False, unlogged:bool=False):
+        if not if_not_exists:
+            self.drop_table(table_name)
         columns_statement = ',\n\t'.join([f"{key} {value}" for key, value in columns_dict.items()])
         query = f"""
-                CREATE TABLE {table_name} (
+                CREATE {'UNLOGGED ' if unlogged else ''}TABLE {'IF NOT EXISTS ' if if_not_exists else ''}{table_name} (
                 \t{columns_statement});
                 """.replace("  ", "")
         
         result = self._execute_query(query)
         logger.info(f"Table {table_name} created: {result}")
+        return result
+
+    @staticmethod
+    def index_name(table_name:str, columns:list, unique:bool=False):
+        return f"{table_name}_{'_'.join(columns)}_{'key' if unique else 'idx'}".lower()
+
+    def create_index(self, table_name:str, columns:list, unique:bool=False):
+        index_name = self.index_name(table_name, columns, unique)
+        query = f"""CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index_name}
+                    ON {table_name} ({', '.join(columns)});"""
+        result = self._execute_query(query)
+        logger.info(f"Index {index_name} created: {result}")
+        return result
+
+    def create_unique_index(self, table_name:str, key_columns:list):
+        return self.create_index(table_name, key_columns, unique=True)
         
     def copy_to_table(self, file_object, table_name:str, columns:list, sep:str='\t', null_value:str=''):
         file_object.seek(0)
-        number_records = len([entry for entry in file_object.getvalue().split('\n') if entry])
         cursor = self.conn.cursor()
         cursor.copy_from(file_object, table=table_name, columns=columns, sep=sep, null=null_value)
+        logger.info(f"Inserted {cursor.rowcount} Records to Table {table_name}")
+
+    def copy_stream_to_table(self, stream, table_name:str, columns:list, sep:str='\t', null_value:str=copy_text.NULL,
+                             buffer_size:int=65536):
+        """
+        COPY a text formatted, file like stream into a table, reading `buffer_size` characters at a time.
+        Return:
+            {int} - number of records copied
+        """
+        query = f"""COPY {table_name} ({', '.join(columns)}) FROM STDIN
+                    WITH (FORMAT text, DELIMITER '{sep}', NULL '{null_value}');"""
+        cursor = self.conn.cursor()
+        cursor.copy_expert(query, stream, size=buffer_size)
+        number_records = getattr(stream, 'rows', cursor.rowcount)
         logger.info(f"Inserted {number_records} Records to Table {table_name}")
-    
-    def copy_dataframe_to_table(self, df: pd.DataFrame, table_name:str):
-        file_object = StringIO()
+        return number_records
+
+    def copy_binary_stream_to_table(self, stream, table_name:str, columns:list, buffer_size:int=65536):
+        """
+        COPY a PGCOPY binary, file like stream into a table.
+        Return:
+            {int} - number of records copied
+        """
+        query = f"""COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT binary);"""
+        cursor = self.conn.cursor()
+        cursor.copy_expert(query, stream, size=buffer_size)
+        number_records = getattr(stream, 'rows', cursor.rowcount)
+        logger.info(f"Inserted {number_records} Records to Table {table_name} (binary)")
+        return number_records
+
+    def copy_dataframe_to_table(self, df: pd.DataFrame, table_name:str, chunk_size:int=100000,
+                                binary:bool=False, columns_dict:dict=None):
+        """
+        COPY a DataFrame into a table, as COPY text or, with `binary`, in the PGCOPY binary format.
+        Binary mode encodes the columns straight from their NumPy arrays and needs the table
+        column definitions (`columns_dict`, as in `Config.table_info`) to pick the wire types.
+        """
         column_names = list(df.columns)
-        df.to_csv(file_object, columns=column_names, sep='\t', header=False, index=False)
-        self.copy_to_table(file_object, table_name, column_names)
+        if binary:
+            if not columns_dict:
+                raise ValueError(f"Binary COPY to {table_name} needs the table column definitions")
+            stream = BinaryCopyStream(df, columns_dict, chunk_size=chunk_size)
+            return self.copy_binary_stream_to_table(stream, table_name, column_names)
+        stream = DataFrameCopyStream(df, chunk_size=chunk_size)
+        return self.copy_stream_to_table(stream, table_name, column_names)
     
-    def insert_records(self, table_name:str, records:list):
-        
-        result = self._execute_query(query)
-        logger.info(f"Table {table_name} created: {result}")
-        
-    
-    def delete_records(self, table_name:str, records:list):
+    def upsert_dataframe(self, df:pd.DataFrame, table_name:str, key_columns:list, columns_dict:dict=None,
+                         binary:bool=False):
+        """
+        Merge a DataFrame into a table: rows whose keys already exist are updated, the others inserted.
+        The rows are COPYed to a temporary staging table and merged with one INSERT ... SELECT ... ON CONFLICT.
+        When the DataFrame repeats a key, its last row wins. The keys need a unique index, see `create_unique_index`.
+        Return:
+            {int} - number of rows inserted or updated, False if the merge failed
+        """
+        df = df.drop_duplicates(subset=key_columns, keep='last')
+        column_names = list(df.columns)
+        staging_table_name = f"{table_name}_staging"
+        self._execute_query(f"""DROP TABLE IF EXISTS {staging_table_name};""")
+        if not self._execute_query(f"""CREATE TEMP TABLE {staging_table_name} (LIKE {table_name});"""):
+            return False
+        self.copy_dataframe_to_table(df, staging_table_name, binary=binary, columns_dict=columns_dict)
+
+        update_columns = [column for column in column_names if column not in key_columns]
+        conflict_action = ('DO UPDATE SET ' + ', '.join([f"{column} = EXCLUDED.{column}" for column in update_columns])
+                           if update_columns else 'DO NOTHING')
+        query = f"""INSERT INTO {table_name} ({', '.join(column_names)})
+                    SELECT {', '.join(column_names)} FROM {staging_table_name}
+                    ON CONFLICT ({', '.join(key_columns)}) {conflict_action};"""
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(query)
+            result = cursor.rowcount
+        except DatabaseError:
+            logger.exception(f"Merging into Table {table_name} failed")
+            result = False
+        self._execute_query(f"""DROP TABLE IF EXISTS {staging_table_name};""")
+        logger.info(f"Upserted {result} Records to Table {table_name}")
+        return result
+
+    def load_table(self, table_name:str, df:pd.DataFrame, columns_dict:dict, binary:bool=False):
+        """
+        Create a table and COPY a DataFrame into it.
+        Return:
+            {dict} - load report with status, records and seconds
+        """
+        start = time.perf_counter()
+        if not self.create_table(table_name, columns_dict):
+            raise DatabaseError(f"Could not create table {table_name}")
+        records = self.copy_dataframe_to_table(df, table_name, binary=binary, columns_dict=columns_dict)
+        return {'status': 'loaded', 'records': records, 'seconds': time.perf_counter() - start}
+
+    def load_tables_concurrently(self, tables:dict, max_workers:int=None):
+        """
+        Load independent tables in parallel, each over its own pooled connection.
+        A failing table is reported without aborting the loads of the other tables.
+        Arguments:
+            - tables {dict} - table name to a dict with `df`, `columns_dict` and optional `binary`
+            - max_workers {int} - maximum number of concurrent loads, defaults to the pool size
+        Return:
+            {dict} - table name to its load report
+        """
+        max_workers = min(max_workers or self.max_connections, self.max_connections)
+
+        def load(table_name:str, table:dict):
+            try:
+                with self.pooled_connection() as conn:
+                    return self.with_connection(conn).load_table(table_name, table['df'], table['columns_dict'],
+                                                                 binary=table.get('binary', False))
+            except Exception as error:
+                logger.exception(f"Loading Table {table_name} failed")
+                return {'status': 'failed', 'error': repr(error)}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {table_name: executor.submit(load, table_name, table) for table_name, table in tables.items()}
+            reports = {table_name: future.result() for table_name, future in futures.items()}
+
+        for table_name, report in reports.items():
+            if report['status'] == 'loaded':
+                logger.info(f"Table {table_name}: {report['records']} Records loaded in {report['seconds']:.2f}s")
+            else:
+                logger.error(f"Table {table_name}: load failed with {report['error']}")
+        return reports
+
+    def _run_pooled(self, name:str, function, *args):
+        """
+        Run a helper over a pooled connection, timing it. Errors are reported instead of raised.
+        Return:
+            {tuple} - (name, seconds, result or False)
+        """
+        start = time.perf_counter()
+        try:
+            with self.pooled_connection() as conn:
+                result = function(self.with_connection(conn), *args)
+        except Exception:
+            logger.exception(f"{name} failed")
+            result = False
+        return name, time.perf_counter() - start, result
+
+    def delete_duplicates(self, table_name:str, key_columns:list):
+        """
+        Delete every row of a table whose key is repeated by a row stored after it (higher ctid),
+        keeping the last loaded row of each key, as `drop_duplicates(keep='last')` does in memory.
+        Used for tables loaded chunk by chunk, before their unique keys are built.
+        Return:
+            {int} - number of rows deleted, False if the statement failed
+        """
+        conditions = ' AND '.join(f"a.{column} = b.{column}" for column in key_columns)
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f"""DELETE FROM {table_name} a USING {table_name} b
+                               WHERE {conditions} AND a.ctid < b.ctid;""")
+            result = cursor.rowcount
+        except Exception:
+            logger.exception(f"Deleting duplicates of Table {table_name} failed")
+            return False
+        logger.info(f"Deleted {result} duplicate Records from Table {table_name}")
+        return result
+
+    def finalize_bulk_load(self, tables:dict, max_workers:int=None, maintenance_work_mem:str='256MB'):
+        """
+        Bulk-load lifecycle step run once tables are loaded without indexes:
+        build every key and secondary index in parallel, promote keys to primary key
+        constraints, then ANALYZE each table. Every step is timed and logged per table.
+        Arguments:
+            - tables {dict} - table name to a dict with optional `key_columns` (unique key),
+              `primary_key` (promote the key to a primary key) and `indexes` (list of column lists)
+            - max_workers {int} - maximum number of concurrent statements, defaults to the pool size
+            - maintenance_work_mem {str} - memory given to each index build
+        Return:
+            {dict} - table name to its timings in seconds and step results
+        """
+        max_workers = min(max_workers or self.max_connections, self.max_connections)
+        reports = {table_name: {'indexes_seconds': 0.0, 'constraint_seconds': 0.0, 'analyze_seconds': 0.0,
+                                'failed': []}
+                   for table_name in tables}
+
+        def build_index(postgre, table_name:str, columns:list, unique:bool):
+            postgre._execute_query(f"""SET maintenance_work_mem = '{maintenance_work_mem}';""")
+            return postgre.create_index(table_name, columns, unique)
+
+        def add_constraint_and_analyze(postgre, table_name:str, table:dict):
+            constraint_start = time.perf_counter()
+            result = True
+            if table.get('key_columns') and table.get('primary_key'):
+                index_name = postgre.index_name(table_name, table['key_columns'], unique=True)
+                # Unnamed, the constraint keeps the index name, so `create_unique_index` finds it again
+                result = postgre._execute_query(f"""ALTER TABLE {table_name}
+                                                    ADD PRIMARY KEY USING INDEX {index_name};""")
+            constraint_seconds = time.perf_counter() - constraint_start
+            analyze_start = time.perf_counter()
+            analyzed = postgre._execute_query(f"""ANALYZE {table_name};""")
+            return result, constraint_seconds, analyzed, time.perf_counter() - analyze_start
+
+        index_builds = []
+        for table_name, table in tables.items():
+            if table.get('key_columns'):
+                index_builds.append((table_name, table['key_columns'], True))
+            for columns in table.get('indexes', []):
+                index_builds.append((table_name, columns, False))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [(table_name, executor.submit(self._run_pooled, self.index_name(table_name, columns, unique),
+                                                    build_index, table_name, columns, unique))
+                       for table_name, columns, unique in index_builds]
+            for table_name, future in futures:
+                name, seconds, result = future.result()
+                reports[table_name]['indexes_seconds'] += seconds
+                if not result:
+                    reports[table_name]['failed'].append(name)
+
+            futures = {table_name: executor.submit(self._run_pooled, f"Finalizing Table {table_name}",
+                                                   add_constraint_and_analyze, table_name, table)
+                       for table_name, table in tables.items()}
+            for table_name, future in futures.items():
+                _, _, result = future.result()
+                constrained, constraint_seconds, analyzed, analyze_seconds = result or (False, 0.0, False, 0.0)
+                reports[table_name]['constraint_seconds'] = constraint_seconds
+                reports[table_name]['analyze_seconds'] = analyze_seconds
+                if not constrained:
+                    reports[table_name]['failed'].append('primary key')
+                if not analyzed:
+                    reports[table_name]['failed'].append('analyze')
+
+        for table_name, report in reports.items():
+            logger.info(f"Table {table_name} finalized: indexes {report['indexes_seconds']:.2f}s, "
+                        f"constraints {report['constraint_seconds']:.2f}s, analyze {report['analyze_seconds']:.2f}s"
+                        + (f", failed: {', '.join(report['failed'])}" if report['failed'] else ""))
+        return reports
+
+    @staticmethod
+    def _records_to_rows(records:list, columns:list=None):
+        """
+        Normalize a list of dicts, or of sequences plus their column names, to column names and row tuples.
+        """
+        if records and isinstance(records[0], dict):
+            columns = columns or list(records[0].keys())
+            return columns, [tuple(record.get(column) for column in columns) for record in records]
+        if not columns:
+            raise ValueError("Column names are needed for records given as sequences")
+        return columns, [tuple(record) for record in records]
+
+    @staticmethod
+    def _last_row_per_key(rows:list, key_indexes:list):
+        """
+        Keep the last row of each key, as one statement cannot update the same row twice with ON CONFLICT.
+        Rows with a null key are all kept, they never conflict.
+        """
+        last_rows = {}
+        for position, row in enumerate(rows):
+            key = tuple(row[index] for index in key_indexes)
+            last_rows[(position,) if None in key else key] = row
+        return list(last_rows.values())
+
+    def _execute_paged(self, query:str, rows:list, page_size:int):
+        """
+        Run a `VALUES %s` statement over pages of rows with `execute_values`, one statement per page.
+        On an autocommit connection the pages run in a single transaction, so a failing page rolls back
+        the ones before it. Otherwise the caller's transaction is left for it to commit or roll back.
+        Return:
+            {int} - number of rows affected, False if the statement failed
+        """
+        own_transaction = self.conn.autocommit
+        if own_transaction:
+            self.conn.autocommit = False
+        cursor = self.conn.cursor()
+        affected = 0
+        try:
+            for start in range(0, len(rows), page_size):
+                page = rows[start:start + page_size]
+                execute_values(cursor, query, page, page_size=len(page))
+                affected += cursor.rowcount
+            if own_transaction:
+                self.conn.commit()
+            return affected
+        except DatabaseError:
+            logger.exception("Database Error")
+            if own_transaction:
+                self.conn.rollback()
+            return False
+        finally:
+            if own_transaction:
+                self.conn.autocommit = True
+
+    def add_primary_key(self, table_name:str, key_columns:list):
+        query = f"""ALTER TABLE {table_name} ADD PRIMARY KEY ({', '.join(key_columns)});"""
         result = self._execute_query(query)
-        logger.info(f"Table {table_name} created: {result}")
-            
+        logger.info(f"Primary key ({', '.join(key_columns)}) added to Table {table_name}: {result}")
+        return result
 
+    def insert_records(self, table_name:str, records:list, columns:list=None, key_columns:list=None,
+                       page_size:int=1000):
+        """
+        Insert records with multi row VALUES statements of `page_size` rows, all committed or none.
+        With `key_columns` the insert becomes an upsert: rows conflicting on those keys update the
+        remaining columns, and when the records repeat a key its last record wins.
+        The keys need a primary key or unique constraint, see `add_primary_key`.
+        Arguments:
+            - table_name {str} - table to write to
+            - records {list} - list of dicts, or of sequences ordered as `columns`
+            - columns {list} - column names, defaults to the keys of the first record
+            - key_columns {list} - conflict keys turning the insert into an upsert
+            - page_size {int} - rows per statement
+        Return:
+            {int} - number of rows inserted or updated, False if the statement failed
+        """
+        if not records:
+            return 0
+        columns, rows = self._records_to_rows(records, columns)
+        query = f"""INSERT INTO {table_name} ({', '.join(columns)}) VALUES %s"""
+        if key_columns:
+            update_columns = [column for column in columns if column not in key_columns]
+            if update_columns:
+                updates = ', '.join([f"{column} = EXCLUDED.{column}" for column in update_columns])
+                query += f""" ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}"""
+            else:
+                query += f""" ON CONFLICT ({', '.join(key_columns)}) DO NOTHING"""
+            rows = self._last_row_per_key(rows, [columns.index(column) for column in key_columns])
 
+        result = self._execute_paged(query, rows, page_size)
+        logger.info(f"{'Upserted' if key_columns else 'Inserted'} {result} Records to Table {table_name}")
+        return result
 
+    def delete_records(self, table_name:str, records:list, key_columns:list, page_size:int=1000):
+        """
+        Delete the rows matching the keys of the given records, `page_size` keys per statement.
+        Arguments:
+            - table_name {str} - table to delete from
+            - records {list} - list of dicts holding the key columns, or of key sequences ordered as `key_columns`
+            - key_columns {list} - columns identifying the rows to delete
+            - page_size {int} - keys per statement
+        Return:
+            {int} - number of rows deleted, False if the statement failed
+        """
+        if not records:
+            return 0
+        key_columns, rows = self._records_to_rows(records, key_columns)
+        conditions = ' AND '.join([f"{table_name}.{column} = deleted_keys.{column}" for column in key_columns])
+        query = f"""DELETE FROM {table_name} USING (VALUES %s) AS deleted_keys ({', '.join(key_columns)})
+                    WHERE {conditions}"""
+        result = self._execute_paged(query, rows, page_size)
+        logger.info(f"Deleted {result} Records from Table {table_name}")
+        return result
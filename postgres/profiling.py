@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from io import StringIO
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+SAMPLING = 'sampling'
+CPROFILE = 'cprofile'
+AUTO = 'auto'
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler sampling the Python stacks of every thread from a daemon thread.
+    Each sample costs one `sys._current_frames` call, so the overhead depends on the sampling
+    `interval` and not on the number of function calls, unlike cProfile. Samples are kept as
+    collapsed stacks, `thread;outer;...;inner` to number of samples.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own_thread_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.samples
+
+    def write(self, path: str):
+        """Write the collapsed stacks, the input format of flamegraph.pl, speedscope and inferno."""
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top(self, number: int = 20):
+        """
+        Return:
+            {str} - the functions with the most samples on top of the stack (self) and anywhere in it (total)
+        """
+        own, total = Counter(), Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(';')[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        number_samples = sum(self.samples.values()) or 1
+        lines = [f"{number_samples} samples every {self.interval * 1000:.1f}ms",
+                 f"{'self %':>8} {'total %':>8}  function"]
+        for frame, count in own.most_common(number):
+            lines.append(f"{100 * count / number_samples:8.1f} {100 * total[frame] / number_samples:8.1f}  {frame}")
+        return '\n'.join(lines)
+
+
+class CProfileProfiler(object):
+    """
+    Deterministic profiler fallback, for interpreters without `sys._current_frames`.
+    It only sees the thread it is started in and writes pstats files, not collapsed stacks.
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        return self.profile
+
+    def write(self, path: str):
+        self.profile.dump_stats(path)
+
+    def top(self, number: int = 20):
+        output = StringIO()
+        pstats.Stats(self.profile, stream=output).sort_stats('tottime').print_stats(number)
+        return output.getvalue().strip()
+
+
+class StageProfiler(object):
+    """
+    Profiles every stage of a run separately, see `metrics.RunMetrics`.
+
+    For each stage a `<stage>.collapsed` file (sampling) or `<stage>.prof` file (cProfile) is
+    written to `output_dir`, and the top `top` hotspots of all stages are gathered in `summary.txt`.
+
+    Example:
+        profiler = StageProfiler('./profile')
+        metrics = RunMetrics('sparkify_postgres', profiler=profiler)
+        ... run the stages ...
+        profiler.write_summary()
+    """
+
+    def __init__(self, output_dir: str, mode: str = AUTO, interval: float = 0.005, top: int = 20):
+        if mode == AUTO:
+            mode = SAMPLING if hasattr(sys, '_current_frames') else CPROFILE
+        self.mode = mode
+        self.output_dir = output_dir
+        self.interval = interval
+        self.top = top
+        self.summaries = []
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _create(self):
+        return SamplingProfiler(self.interval) if self.mode == SAMPLING else CProfileProfiler()
+
+    @contextmanager
+    def profile(self, stage_name: str):
+        profiler = self._create()
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            yield profiler
+        finally:
+            profiler.stop()
+            extension = 'collapsed' if self.mode == SAMPLING else 'prof'
+            path = os.path.join(self.output_dir, f"{stage_name}.{extension}")
+            profiler.write(path)
+            self.summaries.append(f"== {stage_name} ({time.perf_counter() - start:.2f}s, {path})\n"
+                                  f"{profiler.top(self.top)}")
+
+    def write_summary(self):
+        path = os.path.join(self.output_dir, 'summary.txt')
+        with open(path, 'w') as f:
+            f.write(f"Profile mode: {self.mode}\n\n" + '\n\n'.join(self.summaries) + '\n')
+        logger.info(f"Profiles of {len(self.summaries)} stages written to {self.output_dir}")
+        return path
@@ -0,0 +1,149 @@
+import logging
+import pandas as pd
+
+from postgre import Postgre
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class SongArtistIndex(object):
+    """
+    In-memory matching index used to resolve `song_id` and `artist_id` for log events.
+    The index is built once from the songs and artists dataframes and keyed on
+    song title, artist name and song duration. Durations are matched within
+    `duration_tolerance` seconds, the closest candidate wins.
+
+    Example:
+        index = SongArtistIndex.from_dataframes(songs_df, artists_df)
+        logs_df[['song_id', 'artist_id']] = index.match(logs_df)
+    """
+    KEY_COLUMNS = ['title', 'artist_name']
+
+    def __init__(self, catalog_df: pd.DataFrame, duration_tolerance: float = 0.01):
+        self.duration_tolerance = duration_tolerance
+        self.catalog = (catalog_df[['song_id', 'artist_id', 'title', 'artist_name', 'duration']]
+                        .dropna(subset=self.KEY_COLUMNS + ['duration'])
+                        .drop_duplicates()
+                        .reset_index(drop=True))
+        self.matched = 0
+        self.missed = 0
+
+    @classmethod
+    def from_dataframes(cls, songs_df: pd.DataFrame, artists_df: pd.DataFrame, duration_tolerance: float = 0.01):
+        """
+        Builds the index from the songs and artists dataframes, joined on `artist_id`.
+        Arguments:
+            - songs_df {pd.DataFrame} - songs with song_id, artist_id, title and duration
+            - artists_df {pd.DataFrame} - artists with artist_id and artist_name
+            - duration_tolerance {float} - maximum absolute difference in seconds between durations
+        Return:
+            {SongArtistIndex}
+        """
+        artists = artists_df[['artist_id', 'artist_name']].drop_duplicates()
+        catalog_df = songs_df[['song_id', 'artist_id', 'title', 'duration']].merge(artists, on='artist_id', how='inner')
+        return cls(catalog_df, duration_tolerance)
+
+    def __len__(self):
+        return self.catalog.shape[0]
+
+    def match(self, logs_df: pd.DataFrame, song_column: str = 'song', artist_column: str = 'artist',
+              length_column: str = 'length'):
+        """
+        Resolves song and artist ids for every row of the log dataframe in a single vectorized pass.
+        Rows missing any of the keys, or without a candidate inside the tolerance, get None.
+        Arguments:
+            - logs_df {pd.DataFrame} - log events
+        Return:
+            {pd.DataFrame} - song_id and artist_id columns aligned with logs_df index
+        """
+        keys = (logs_df[[song_column, artist_column, length_column]]
+                .dropna()
+                .rename(columns={song_column: 'title', artist_column: 'artist_name', length_column: 'length'}))
+        keys['row'] = keys.index
+
+        candidates = keys.merge(self.catalog, on=self.KEY_COLUMNS, how='inner')
+        candidates['distance'] = (candidates['duration'] - candidates['length']).abs()
+        candidates = (candidates[candidates['distance'] <= self.duration_tolerance]
+                      .sort_values(['row', 'distance'], kind='mergesort')
+                      .drop_duplicates(subset='row', keep='first')
+                      .set_index('row'))
+
+        results = pd.DataFrame({'song_id': None, 'artist_id': None}, index=logs_df.index, dtype=object)
+        results.loc[candidates.index, ['song_id', 'artist_id']] = candidates[['song_id', 'artist_id']].values
+
+        self.matched = candidates.shape[0]
+        self.missed = logs_df.shape[0] - self.matched
+        logger.info(f"Song/Artist matching: {self.matched} matched, {self.missed} missed "
+                    f"out of {logs_df.shape[0]} log records")
+        return results
+
+
+def match_in_database(postgre: Postgre, logs_df: pd.DataFrame, songs_table_name: str, artists_table_name: str,
+                      duration_tolerance: float = 0.01, song_column: str = 'song', artist_column: str = 'artist',
+                      length_column: str = 'length'):
+    """
+    Resolves song and artist ids with a single set-based join inside Postgres.
+    Used when the song catalog is too large to hold in memory: the distinct log keys are
+    copied to a temporary table and joined once against the songs and artists tables.
+    Arguments:
+        - postgre {Postgre} - connection holding the songs and artists tables
+        - logs_df {pd.DataFrame} - log events
+        - songs_table_name {str} - songs table name
+        - artists_table_name {str} - artists table name
+        - duration_tolerance {float} - maximum absolute difference in seconds between durations
+    Return:
+        {pd.DataFrame} - song_id and artist_id columns aligned with logs_df index
+    """
+    keys_table_name = 'log_song_keys'
+    keys = (logs_df[[song_column, artist_column, length_column]]
+            .dropna()
+            .drop_duplicates()
+            .rename(columns={song_column: 'song', artist_column: 'artist', length_column: 'length'})
+            .reset_index(drop=True))
+    keys['key_id'] = keys.index
+
+    postgre._execute_query(f"""DROP TABLE IF EXISTS {keys_table_name};""")
+    postgre._execute_query(f"""CREATE TEMP TABLE {keys_table_name} (
+                                key_id INTEGER, song TEXT, artist TEXT, length DOUBLE PRECISION);""")
+    postgre.copy_dataframe_to_table(keys[['key_id', 'song', 'artist', 'length']], keys_table_name)
+
+    query = f"""SELECT DISTINCT ON (k.key_id) k.key_id, s.song_id, s.artist_id
+                FROM {keys_table_name} k
+                JOIN {songs_table_name} s ON s.title = k.song
+                JOIN {artists_table_name} a ON a.artist_id = s.artist_id AND a.artist_name = k.artist
+                WHERE ABS(s.duration - k.length) <= %s
+                ORDER BY k.key_id, ABS(s.duration - k.length);"""
+    matches = pd.DataFrame(postgre.execute_prepared(query, (duration_tolerance,), results=True) or [],
+                           columns=['key_id', 'song_id', 'artist_id'])
+    postgre._execute_query(f"""DROP TABLE IF EXISTS {keys_table_name};""")
+
+    keyed = keys.merge(matches, on='key_id', how='inner')
+    rows = (logs_df[[song_column, artist_column, length_column]]
+            .rename(columns={song_column: 'song', artist_column: 'artist', length_column: 'length'})
+            .merge(keyed[['song', 'artist', 'length', 'song_id', 'artist_id']],
+                   on=['song', 'artist', 'length'], how='left'))
+    results = rows[['song_id', 'artist_id']].astype(object).where(rows[['song_id', 'artist_id']].notna(), None)
+    results.index = logs_df.index
+
+    matched = int(results['song_id'].notna().sum())
+    logger.info(f"Song/Artist matching (database): {matched} matched, {logs_df.shape[0] - matched} missed "
+                f"out of {logs_df.shape[0]} log records")
+    return results
+
+
+def match_song_artist_ids(postgre: Postgre, logs_df: pd.DataFrame, songs_df: pd.DataFrame, artists_df: pd.DataFrame,
+                          songs_table_name: str, artists_table_name: str, duration_tolerance: float = 0.01,
+                          max_catalog_rows: int = 5000000):
+    """
+    Resolves song and artist ids for the log dataframe, in memory when the catalog
+    fits under `max_catalog_rows`, otherwise with a single join in the database.
+    Return:
+        {pd.DataFrame} - song_id and artist_id columns aligned with logs_df index
+    """
+    if songs_df.shape[0] <= max_catalog_rows:
+        index = SongArtistIndex.from_dataframes(songs_df, artists_df, duration_tolerance)
+        return index.match(logs_df)
+
+    logger.info(f"Song catalog has {songs_df.shape[0]} rows, above {max_catalog_rows}. Matching in database")
+    return match_in_database(postgre, logs_df, songs_table_name, artists_table_name, duration_tolerance)
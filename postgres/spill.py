@@ -0,0 +1,82 @@
+import os
+import shutil
+import logging
+import tempfile
+import importlib.util
+import pandas as pd
+
+from dtypes import concat_compact
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+PARQUET = 'parquet'
+FEATHER = 'feather'
+PICKLE = 'pickle'
+
+
+def default_spill_format():
+    """Parquet when pyarrow is installed, otherwise pickle, which needs no extra dependency."""
+    return PARQUET if importlib.util.find_spec('pyarrow') else PICKLE
+
+
+class SpillStore(object):
+    """
+    Local disk store of DataFrame partitions that do not need to stay in memory.
+
+    Every partition is written to its own file under a named group, and a group is read
+    back as one DataFrame once all of its partitions were spilled. Files are removed by `close`.
+
+    Example:
+        with SpillStore() as store:
+            for chunk in chunks:
+                store.spill('users', partial_users(chunk))
+            users_df = store.read('users')
+    """
+    WRITERS = {PARQUET: 'to_parquet', FEATHER: 'to_feather', PICKLE: 'to_pickle'}
+    READERS = {PARQUET: pd.read_parquet, FEATHER: pd.read_feather, PICKLE: pd.read_pickle}
+
+    def __init__(self, directory: str = None, spill_format: str = None):
+        self.spill_format = spill_format or default_spill_format()
+        self.created_directory = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix='sparkify-spill-')
+        os.makedirs(self.directory, exist_ok=True)
+        self.partitions = {}
+        self.bytes = 0
+
+    def spill(self, group: str, df: pd.DataFrame):
+        """
+        Write one partition of a group to disk.
+        Return:
+            {str} - path of the partition file
+        """
+        paths = self.partitions.setdefault(group, [])
+        path = os.path.join(self.directory, f"{group}-{len(paths):05d}.{self.spill_format}")
+        getattr(df.reset_index(drop=True), self.WRITERS[self.spill_format])(path)
+        paths.append(path)
+        self.bytes += os.path.getsize(path)
+        return path
+
+    def read(self, group: str):
+        """
+        Return:
+            {pd.DataFrame} - all the partitions of a group, concatenated
+        """
+        reader = self.READERS[self.spill_format]
+        return concat_compact([reader(path) for path in self.partitions.get(group, [])])
+
+    def close(self):
+        for paths in self.partitions.values():
+            for path in paths:
+                os.remove(path)
+        if self.created_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        logger.info(f"Spilled {sum(len(paths) for paths in self.partitions.values())} partitions "
+                    f"({self.bytes / 1024 ** 2:.1f} MB) to {self.directory}")
+        self.partitions = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,208 @@
+import time
+import logging
+import pandas as pd
+
+from postgre import Postgre
+from json_reader import JsonReader, list_json_files
+from manifest import FileManifest
+from metrics import RunMetrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class SqlEngine(object):
+    """
+    In-database ELT engine for the Sparkify star schema.
+
+    The raw song and log records are COPYed once into UNLOGGED staging tables, keeping only
+    the staged columns and, for events, the NextSong pages the pandas engine loads too. Then every
+    star schema table is built inside Postgres with a set based `INSERT ... SELECT`.
+    Target tables are created from the same `Config.table_info` definitions as the pandas
+    engine, and each target column is filled from the expression registered for it in
+    `select_expressions`.
+
+    Example:
+        SqlEngine(postgre, config).run('./data/song_data', './data/log_data')
+    """
+    staging_songs_table_name = 'staging_songs'
+    staging_events_table_name = 'staging_events'
+    staging_table_info = {
+        staging_songs_table_name: {'num_songs': 'INTEGER',
+                                   'artist_id': 'TEXT',
+                                   'artist_latitude': 'DOUBLE PRECISION',
+                                   'artist_longitude': 'DOUBLE PRECISION',
+                                   'artist_location': 'TEXT',
+                                   'artist_name': 'TEXT',
+                                   'song_id': 'TEXT',
+                                   'title': 'TEXT',
+                                   'duration': 'DOUBLE PRECISION',
+                                   'year': 'INTEGER'},
+        staging_events_table_name: {'artist': 'TEXT',
+                                    'auth': 'TEXT',
+                                    'firstName': 'TEXT',
+                                    'gender': 'TEXT',
+                                    'itemInSession': 'INTEGER',
+                                    'lastName': 'TEXT',
+                                    'length': 'DOUBLE PRECISION',
+                                    'level': 'TEXT',
+                                    'location': 'TEXT',
+                                    'method': 'TEXT',
+                                    'page': 'TEXT',
+                                    'registration': 'DOUBLE PRECISION',
+                                    'sessionId': 'INTEGER',
+                                    'song': 'TEXT',
+                                    'status': 'INTEGER',
+                                    'ts': 'BIGINT',
+                                    'userAgent': 'TEXT',
+                                    'userId': 'TEXT'},
+    }
+    staging_filters = {staging_events_table_name: {'page': ['NextSong']}}
+
+    def __init__(self, postgre: Postgre, config, duration_tolerance: float = 0.01, batch_size: int = 50000,
+                 metrics: RunMetrics = None):
+        self.postgre = postgre
+        self.config = config
+        self.metrics = metrics or RunMetrics('sparkify_postgres', labels={'engine': 'sql'})
+        self.duration_tolerance = duration_tolerance
+        self.batch_size = batch_size
+
+    def select_expressions(self):
+        """
+        Return:
+            {dict} - table name to a tuple of (column expressions, FROM/WHERE clause) building it from staging
+        """
+        config = self.config
+        start_time = "(to_timestamp(e.ts / 1000.0) AT TIME ZONE 'UTC')"
+        return {
+            config.songs_table_name: (
+                {'artist_id': 's.artist_id', 'song_id': 's.song_id', 'title': 's.title',
+                 'year': 's.year', 'duration': 's.duration'},
+                f"""(SELECT DISTINCT ON (song_id) * FROM {self.staging_songs_table_name}
+                     WHERE song_id IS NOT NULL ORDER BY song_id) s"""),
+            config.artists_table_name: (
+                {'artist_id': 's.artist_id', 'artist_name': 's.artist_name', 'artist_location': 's.artist_location',
+                 'artist_latitude': 's.artist_latitude', 'artist_longitude': 's.artist_longitude'},
+                f"""(SELECT DISTINCT ON (artist_id) * FROM {self.staging_songs_table_name}
+                     WHERE artist_id IS NOT NULL ORDER BY artist_id) s"""),
+            config.time_table_name: (
+                {'timestamp': 't.start_time',
+                 'hour': 'EXTRACT(hour FROM t.start_time)',
+                 'day': 'EXTRACT(day FROM t.start_time)',
+                 'week': 'EXTRACT(week FROM t.start_time)',
+                 'month': 'EXTRACT(month FROM t.start_time)',
+                 'year': 'EXTRACT(year FROM t.start_time)',
+                 'weekday': 'EXTRACT(isodow FROM t.start_time) - 1'},
+                f"""(SELECT DISTINCT {start_time} AS start_time FROM {self.staging_events_table_name} e
+                     WHERE e.page = 'NextSong' AND e.ts IS NOT NULL) t"""),
+            config.users_table_name: (
+                {'userId': 'e.userId::INTEGER', 'firstName': 'e.firstName', 'lastName': 'e.lastName',
+                 'gender': 'e.gender', 'level': 'e.level'},
+                f"""(SELECT DISTINCT ON (userId) * FROM {self.staging_events_table_name}
+                     WHERE NULLIF(userId, '') IS NOT NULL ORDER BY userId, ts DESC) e"""),
+            config.songsplay_table_name: (
+                {'ts': 'e.ts', 'userId': "NULLIF(e.userId, '')::INTEGER", 'level': 'e.level',
+                 'song_id': 'm.song_id', 'artist_id': 'm.artist_id', 'sessionId': 'e.sessionId',
+                 'location': 'e.location', 'userAgent': 'e.userAgent'},
+                f"""{self.staging_events_table_name} e
+                    LEFT JOIN (
+                        SELECT DISTINCT ON (k.song, k.artist, k.length) k.song, k.artist, k.length,
+                               s.song_id, s.artist_id
+                        FROM (SELECT DISTINCT song, artist, length FROM {self.staging_events_table_name}
+                              WHERE song IS NOT NULL AND artist IS NOT NULL AND length IS NOT NULL) k
+                        JOIN {config.songs_table_name} s ON s.title = k.song
+                        JOIN {config.artists_table_name} a ON a.artist_id = s.artist_id AND a.artist_name = k.artist
+                        WHERE ABS(s.duration - k.length) <= {self.duration_tolerance}
+                        ORDER BY k.song, k.artist, k.length, ABS(s.duration - k.length)
+                    ) m ON m.song = e.song AND m.artist = e.artist AND m.length = e.length"""),
+        }
+
+    def create_staging_tables(self):
+        for table_name, columns_dict in self.staging_table_info.items():
+            self.postgre.create_table(table_name, columns_dict, unlogged=True)
+
+    def stage_json(self, filepath: str, table_name: str):
+        """
+        COPY every raw JSON record under filepath into a staging table, batch by batch.
+        Return:
+            {int} - number of records staged
+        """
+        columns_dict = self.staging_table_info[table_name]
+        integer_columns = [column for column, sql_type in columns_dict.items() if sql_type in ('INTEGER', 'BIGINT')]
+        number_records = 0
+        reader = JsonReader(workers=self.config.reader_workers, batch_size=self.batch_size,
+                            columns=list(columns_dict.keys()), where=self.staging_filters.get(table_name))
+        for batch in reader.iter_batches(filepath):
+            df = pd.DataFrame.from_records(batch).reindex(columns=list(columns_dict.keys()))
+            for column in integer_columns:
+                df[column] = pd.to_numeric(df[column], errors='coerce').astype('Int64')
+            number_records += self.postgre.copy_dataframe_to_table(df, table_name)
+        return number_records
+
+    def build_table(self, table_name: str):
+        """
+        Create a star schema table from `Config.table_info` and fill it with one INSERT ... SELECT.
+        Return:
+            {int} - number of rows inserted, False if the statement failed
+        """
+        columns_dict = self.config.table_info.get(table_name)
+        expressions, from_clause = self.select_expressions()[table_name]
+        self.postgre.create_table(table_name, columns_dict)
+        column_names = list(columns_dict.keys())
+        query = f"""INSERT INTO {table_name} ({', '.join(column_names)})
+                    SELECT {', '.join(expressions[column] for column in column_names)}
+                    FROM {from_clause};"""
+        cursor = self.postgre.conn.cursor()
+        try:
+            cursor.execute(query)
+            result = cursor.rowcount
+        except Exception:
+            logger.exception(f"Building Table {table_name} failed")
+            result = False
+        logger.info(f"Inserted {result} Records to Table {table_name}")
+        return result
+
+    def run(self, songs_filepath: str, logs_filepath: str):
+        """
+        Stage the raw data and build songs, artists, users, time and songplays inside Postgres.
+        Staging, every table build and the final index builds are measured as stages in `metrics`.
+        The raw files are recorded in the manifest once every table is built, so a later incremental
+        run of the pandas engine only loads the files added since.
+        """
+        start = time.perf_counter()
+        manifest = FileManifest(self.postgre, self.config.manifest_table_name)
+        manifest.create_table()
+        raw_files = list_json_files(songs_filepath) + list_json_files(logs_filepath)
+        self.create_staging_tables()
+        for table_name, filepath in ((self.staging_songs_table_name, songs_filepath),
+                                     (self.staging_events_table_name, logs_filepath)):
+            with self.metrics.stage(f'stage_{table_name}') as stage:
+                stage.rows_out = self.stage_json(filepath, table_name)
+                self.postgre._execute_query(f"""ANALYZE {table_name};""")
+        logger.info(f"Raw data staged in {time.perf_counter() - start:.2f}s")
+
+        config = self.config
+        failed_tables = []
+        for table_name in (config.songs_table_name, config.artists_table_name, config.time_table_name,
+                           config.users_table_name, config.songsplay_table_name):
+            with self.metrics.stage(f'build_{table_name}') as stage:
+                result = self.build_table(table_name)
+                stage.rows_out, stage.failed = (None, True) if result is False else (result, False)
+            if result is False:
+                failed_tables.append(table_name)
+        # The other tables are built one row per key, the plays repeating a songplays key are dropped
+        # as the pandas engines do, before its unique index is built
+        with self.metrics.stage('delete_duplicates') as stage:
+            result = self.postgre.delete_duplicates(config.songsplay_table_name,
+                                                    config.table_keys.get(config.songsplay_table_name))
+            stage.rows_out, stage.failed = (None, True) if result is False else (result, False)
+
+        for table_name in self.staging_table_info:
+            self.postgre.drop_table(table_name)
+        with self.metrics.stage('finalize_bulk_load'):
+            self.postgre.finalize_bulk_load(config.bulk_load_tables(), max_workers=config.max_concurrent_loads)
+        if failed_tables:
+            logger.error(f"Tables {', '.join(failed_tables)} failed to build, the raw files are not recorded in the manifest")
+        else:
+            manifest.record(manifest.file_entries(raw_files))
+        logger.info(f"SQL engine completed in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,49 @@
+import os
+import sys
+import argparse
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics.py')
+REPOSITORY = os.path.dirname(os.path.dirname(SOURCE))
+COPIES = (os.path.join('redshift', 'metrics.py'), os.path.join('pyspark', 'lib', 'metrics.py'))
+HEADER = "# Generated from postgres/metrics.py by postgres/sync_metrics.py, do not edit: change the source and rerun it.\n"
+
+
+def generated_content():
+    """
+    Return:
+        {str} - content of every copy, the source with a generated header
+    """
+    with open(SOURCE) as f:
+        return HEADER + f.read()
+
+
+def sync(check: bool = False):
+    """
+    Write `metrics.py` to the projects deployed without the postgres directory.
+    Arguments:
+        - check {bool} - only report the copies that differ from the source
+    Return:
+        {list} - copies that were out of date
+    """
+    content = generated_content()
+    outdated = []
+    for copy in COPIES:
+        path = os.path.join(REPOSITORY, copy)
+        with open(path) as f:
+            if f.read() == content:
+                continue
+        outdated.append(copy)
+        if not check:
+            with open(path, 'w') as f:
+                f.write(content)
+    return outdated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy postgres/metrics.py to the other projects")
+    parser.add_argument('--check', action='store_true', help="fail if a copy differs from the source, write nothing")
+    args = parser.parse_args()
+    outdated = sync(args.check)
+    for copy in outdated:
+        print(f"{copy} {'differs from' if args.check else 'regenerated from'} postgres/metrics.py")
+    sys.exit(1 if args.check and outdated else 0)
@@ -0,0 +1,93 @@
+import time
+import logging
+import argparse
+from datetime import datetime
+
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import udf, col
+from pyspark.sql.types import TimestampType
+
+from lib.time_columns import epoch_ms_to_timestamp, pandas_epoch_ms_to_timestamp, with_time_columns
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.StreamHandler())
+
+FIRST_TS = 1541030400000  # 2018-11-01, start of the log dataset
+MS_PER_ROW = 797  # spreads the synthetic events over a few months
+
+
+def python_udf_timestamp(column):
+    """The former `get_datetime` row at a time Python UDF"""
+    get_datetime = udf(
+        lambda x: datetime.fromtimestamp(x / 1000).replace(microsecond=0),
+        TimestampType()
+    )
+    return get_datetime(column)
+
+
+PATHS = (
+    ("python_udf", python_udf_timestamp),
+    ("pandas_udf", pandas_epoch_ms_to_timestamp),
+    ("native", epoch_ms_to_timestamp),
+)
+
+
+def create_local_spark_session(partitions: int):
+    return SparkSession \
+        .builder \
+        .master("local[*]") \
+        .appName("sparkify_time_columns_benchmark") \
+        .config("spark.sql.shuffle.partitions", partitions) \
+        .config("spark.sql.execution.arrow.pyspark.enabled", "true") \
+        .getOrCreate()
+
+
+def run_path(spark, to_timestamp, rows: int, partitions: int):
+    """
+    Derives start_time and the time table fields of `rows` synthetic events, as `log.py` does,
+    and writes them to the noop sink so only the derivation is measured
+
+    Arguments:
+        spark {SparkSession} -- Local spark session
+        to_timestamp {callable} -- Epoch milliseconds column -> timestamp column
+        rows {int} -- Number of events
+        partitions {int} -- Number of partitions of the events
+
+    Returns:
+        {float} -- Wall seconds
+    """
+    events = spark.range(0, rows, numPartitions=partitions) \
+        .select((col("id") * MS_PER_ROW + FIRST_TS).alias("ts"))
+    time_table = with_time_columns(events.withColumn("start_time", to_timestamp("ts")))
+
+    start = time.perf_counter()
+    time_table.write.format("noop").mode("overwrite").save()
+    return time.perf_counter() - start
+
+
+def main(rows: int, partitions: int, repeat: int):
+    spark = create_local_spark_session(partitions)
+    # Warm up the JVM and the Python workers, so the first path is not penalized
+    run_path(spark, epoch_ms_to_timestamp, min(rows, 100000), partitions)
+
+    results = []
+    for name, to_timestamp in PATHS:
+        seconds = min(run_path(spark, to_timestamp, rows, partitions) for _ in range(repeat))
+        results.append((name, seconds))
+        logger.info(f"{name}: {seconds:.2f}s")
+    spark.stop()
+
+    native_seconds = dict(results)["native"]
+    print(f"{'path':<12} {'seconds':>9} {'rows/s':>12} {'vs native':>10}")
+    for name, seconds in results:
+        print(f"{name:<12} {seconds:9.2f} {rows / seconds:12.0f} {seconds / native_seconds:9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the start_time derivation paths in Spark local mode")
+    parser.add_argument("--rows", type=int, default=5000000, help="number of synthetic events")
+    parser.add_argument("--partitions", type=int, default=8, help="number of partitions of the events")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per path, the fastest is reported")
+    args = parser.parse_args()
+    main(args.rows, args.partitions, args.repeat)
@@ -0,0 +1,171 @@
+import logging
+import argparse
+from collections import Counter
+
+from lib.spark_util import (create_spark_session,
+                             get_file_system,
+                             DerivativeDF,
+                             TARGET_FILE_MB,
+                             MAX_RECORDS_PER_FILE
+                             )
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.StreamHandler())
+
+TABLE_PARTITIONS = {
+    "songs": ["year", "artist_id"],
+    "artists": ["artist_id"],
+    "users": ["level"],
+    "time": ["year", "month"],
+    "songplays": ["year", "month"],
+}
+
+
+def count_partition_files(spark, path: str):
+    """
+    Counts the parquet files of every partition directory of a table
+
+    Arguments:
+        spark {SparkSession} -- Spark Session
+        path {str} -- Table location
+
+    Returns:
+        {Counter} -- Partition directory relative to the table, like `year=2018/month=11`, to number of files
+    """
+    file_system, table_path = get_file_system(spark, path)
+    root = file_system.makeQualified(table_path).toString().rstrip("/")
+    file_counts = Counter()
+    if not file_system.exists(table_path):
+        return file_counts
+    files = file_system.listFiles(table_path, True)
+    while files.hasNext():
+        file_path = files.next().getPath()
+        if file_path.getName().endswith(".parquet"):
+            file_counts[file_path.getParent().toString()[len(root):].strip("/")] += 1
+    return file_counts
+
+
+def move_partition(spark, source: str, destination: str):
+    """
+    Replaces `destination` by `source`. The replaced data is first moved aside and only deleted
+    once `source` is in place, and moved back if that fails: on S3 a rename is a copy and a delete,
+    which can fail halfway
+
+    Arguments:
+        spark {SparkSession} -- Spark Session
+        source {str} -- New data location
+        destination {str} -- Location replaced
+    """
+    file_system, source_path = get_file_system(spark, source)
+    destination_path = get_file_system(spark, destination)[1]
+    replaced_path = get_file_system(spark, f"{destination.rstrip('/')}_replaced")[1]
+    file_system.delete(replaced_path, True)
+    replaced = file_system.exists(destination_path)
+    if replaced and not file_system.rename(destination_path, replaced_path):
+        raise IOError(f"Could not move `{destination}` aside")
+    try:
+        file_system.mkdirs(destination_path.getParent())
+        if not file_system.rename(source_path, destination_path):
+            raise IOError(f"Could not move `{source}` to `{destination}`")
+    except Exception:
+        if replaced:
+            file_system.delete(destination_path, True)
+            file_system.rename(replaced_path, destination_path)
+        raise
+    if replaced:
+        file_system.delete(replaced_path, True)
+
+
+def compact_table(spark, path: str, partitions: list, min_files: int = 2, target_file_mb: int = TARGET_FILE_MB,
+                  max_records_per_file: int = MAX_RECORDS_PER_FILE):
+    """
+    Rewrites the fragmented partitions of a parquet table, the ones with at least `min_files` files,
+    into as few files as `DerivativeDF._write_to_parquet` writes. The partitions are written to a
+    staging location next to the table and then moved in place of the fragmented ones, as Spark
+    cannot overwrite the files it is reading
+
+    Arguments:
+        spark {SparkSession} -- Spark Session
+        path {str} -- Table location
+        partitions {list} -- Partition columns of the table
+
+    Keyword Arguments:
+        min_files {int} -- Files from which a partition is rewritten (default: {2})
+        target_file_mb {int} -- Target file size in MB (default: {TARGET_FILE_MB})
+        max_records_per_file {int} -- Largest number of records of a file (default: {MAX_RECORDS_PER_FILE})
+
+    Returns:
+        {tuple} -- Files per partition before and after, number of partitions rewritten
+    """
+    path = path.rstrip("/")
+    before = count_partition_files(spark, path)
+    fragmented = sorted(partition for partition, files in before.items() if files >= min_files)
+    if not fragmented:
+        logger.info(f"`{path}` has no partition with {min_files} files or more")
+        return before, before, 0
+
+    logger.info(f"Compacting {len(fragmented)} of the {len(before)} partitions of `{path}`")
+    staging_path = f"{path}_compacting"
+    if partitions:
+        df = spark.read.option("basePath", path).parquet(*[f"{path}/{partition}" for partition in fragmented])
+    else:
+        df = spark.read.parquet(path)
+    DerivativeDF(df)._write_to_parquet(staging_path, partitions=partitions, target_file_mb=target_file_mb,
+                                       max_records_per_file=max_records_per_file)
+
+    if partitions:
+        for partition in fragmented:
+            move_partition(spark, f"{staging_path}/{partition}", f"{path}/{partition}")
+        file_system, staging = get_file_system(spark, staging_path)
+        file_system.delete(staging, True)
+    else:
+        move_partition(spark, staging_path, path)
+
+    after = count_partition_files(spark, path)
+    return before, after, len(fragmented)
+
+
+def run_compaction(output_bucket_name: str, tables: list, min_files: int = 2, target_file_mb: int = TARGET_FILE_MB,
+                   max_records_per_file: int = MAX_RECORDS_PER_FILE):
+    """
+    Compacts the output tables of the Sparkify ETL and reports their file counts
+
+    Arguments:
+        output_bucket_name {str} -- Output bucket name
+        tables {list} -- Tables to compact, keys of TABLE_PARTITIONS
+
+    Keyword Arguments:
+        min_files {int} -- Files from which a partition is rewritten (default: {2})
+        target_file_mb {int} -- Target file size in MB (default: {TARGET_FILE_MB})
+        max_records_per_file {int} -- Largest number of records of a file (default: {MAX_RECORDS_PER_FILE})
+
+    Returns:
+        {list} -- table, partitions, partitions rewritten, files before, files after
+    """
+    spark = create_spark_session()
+    # Partition values read back as strings are written to the same directory names, `month=01` stays `month=01`
+    spark.conf.set("spark.sql.sources.partitionColumnTypeInference.enabled", "false")
+    report = []
+    for table in tables:
+        before, after, rewritten = compact_table(spark, f"s3://{output_bucket_name}/{table}", TABLE_PARTITIONS[table],
+                                                 min_files, target_file_mb, max_records_per_file)
+        report.append((table, len(after), rewritten, sum(before.values()), sum(after.values())))
+
+    print(f"{'table':<10} {'partitions':>10} {'rewritten':>10} {'files before':>13} {'files after':>12}")
+    for table, number_partitions, rewritten, files_before, files_after in report:
+        print(f"{table:<10} {number_partitions:>10} {rewritten:>10} {files_before:>13} {files_after:>12}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact the small parquet files of the Sparkify tables")
+    parser.add_argument("--bucket", default="sparkify-dev", help="output bucket of the ETL")
+    parser.add_argument("--tables", nargs="+", choices=list(TABLE_PARTITIONS), default=list(TABLE_PARTITIONS),
+                        help="tables to compact, all by default")
+    parser.add_argument("--min-files", type=int, default=2, help="files from which a partition is rewritten")
+    parser.add_argument("--target-file-mb", type=int, default=TARGET_FILE_MB, help="target file size in MB")
+    parser.add_argument("--max-records-per-file", type=int, default=MAX_RECORDS_PER_FILE,
+                        help="largest number of records of a file")
+    args = parser.parse_args()
+    run_compaction(args.bucket, args.tables, args.min_files, args.target_file_mb, args.max_records_per_file)
@@ -1,11 +1,15 @@
 import os
 import logging
+import argparse
 import configparser
+from datetime import date
 
 
-from lib.spark_util import create_spark_session
+from lib.spark_util import create_spark_session, existing_locations, SparkDF
 from lib.s3_util import create_bucket
-from src.song import process_song_data
+from lib.metrics import RunMetrics
+from lib.join_planner import BROADCAST_THRESHOLD_MB
+from src.song import process_song_data, load_song_tables
 from src.log import process_log_data
 
 logger = logging.getLogger()
@@ -26,7 +30,28 @@ def setup_aws_env():
     os.environ['AWS_DEFAULT_REGION'] = config['AWS']['AWS_DEFAULT_REGION']
 
 
-def get_raw_data_location(dry_run: bool = False):
+def get_months(start_date: date, end_date: date):
+    """
+    Months overlapping a date range, both ends included
+
+    Arguments:
+        start_date {date} -- First day of the range
+        end_date {date} -- Last day of the range
+
+    Returns:
+        {list} -- (year, month) tuples
+    """
+    if end_date < start_date:
+        raise ValueError(f"End date {end_date} is before start date {start_date}")
+    months = []
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def get_raw_data_location(dry_run: bool = False, months: list = None):
     """
     Gets raw data location, depending on the dry_run parameter
     Returns just a small amount of data in case of dry run, used
@@ -34,13 +59,18 @@ def get_raw_data_location(dry_run: bool = False):
 
     Keyword Arguments:
         dry_run {bool} -- Users choice of it is testing or no (default: {False})
+        months {list} -- (year, month) tuples of an incremental run, whose `log_data/YYYY/MM`
+                         locations are returned as the log data path (default: {None})
 
     Returns:
         {tuple} -- Raw data paths
     """
     raw_data_bucket_name = "udacity-dend"
 
-    if not dry_run:
+    if months:
+        song_data_path = None
+        log_data_path = [f"s3a://{raw_data_bucket_name}/log_data/{year:04d}/{month:02d}" for year, month in months]
+    elif not dry_run:
         song_data_path = f"s3a://{raw_data_bucket_name}/song_data/*/*/*"
         log_data_path = f"s3a://{raw_data_bucket_name}/log_data/*/*"
     else:
@@ -65,7 +95,9 @@ def setup_output(output_bucket_name: str, bucket_exists: bool = True):
         create_bucket(output_bucket_name)
 
 
-def run_sparkify_etl(output_bucket_name: str, song_data_path: str, log_data_path: str):
+def run_sparkify_etl(output_bucket_name: str, song_data_path: str, log_data_path,
+                     metrics_paths: tuple = ('etl_metrics.json',), storage_level: str = 'MEMORY_AND_DISK',
+                     broadcast_threshold_mb: int = BROADCAST_THRESHOLD_MB, months: list = None):
     """
     Run complete Sparkify ETL processing the Raw Songs and Log data and transforming it
     to a Star Schema data model, with 4 Dimension tables and 1 main table
@@ -78,32 +110,70 @@ def run_sparkify_etl(output_bucket_name: str, song_data_path: str, log_data_path
             - Songsplay
     Data is written to S3 in the Parquet format, partioned by key parameters for performance
 
+    With `months` the run is incremental: the songs and artists written by a previous full run
+    are read back instead of reprocessing the song data, and only the `year`/`month` partitions
+    of time and songplays of these months are overwritten, the other partitions are left untouched.
+    Users is only rebuilt by full runs
+
     Arguments:
         output_bucket_name {str} -- Output Bucket Name
-        song_data_path {str} --  S3 Path to Raw Song Data
-        log_data_path {str} -- S3 Path to Raw Log Data
+        song_data_path {str} --  S3 Path to Raw Song Data, unused by incremental runs
+        log_data_path {str|list} -- S3 Path(s) to Raw Log Data
+
+    Keyword Arguments:
+        metrics_paths {tuple} -- Files the per stage metrics are written to, `.prom` ones as
+                                 Prometheus textfiles (default: {('etl_metrics.json',)})
+        storage_level {str} -- `pyspark.StorageLevel` of the frames read by more than one table,
+                               like MEMORY_AND_DISK_SER on memory constrained clusters (default: {'MEMORY_AND_DISK'})
+        broadcast_threshold_mb {int} -- Largest song lookup broadcast to the songplays join in MB
+                                        (default: {BROADCAST_THRESHOLD_MB})
+        months {list} -- (year, month) tuples of an incremental run, see `get_months` (default: {None})
     """
 
-    spark = create_spark_session()
+    SparkDF.set_storage_level(storage_level)
+    metrics = RunMetrics('sparkify_spark', labels={'output': output_bucket_name,
+                                                   'mode': 'incremental' if months else 'full'})
+    with metrics.stage('create_spark_session'):
+        spark = create_spark_session()
 
     logger.info(f"Running Sparkigy ETL.\n \
                   Writting output to `{output_bucket_name}`"
                 )
-    logger.info("Processing Song Data")
-    songs, artists = process_song_data(
-        spark, song_data_path, output_bucket_name)
+    if months:
+        logger.info(f"Incremental run of {len(months)} months")
+        log_data_path = existing_locations(spark, log_data_path)
+        if not log_data_path:
+            logger.info("No log data in the date range, nothing to process")
+            metrics.write(*metrics_paths)
+            return
+        songs, artists = load_song_tables(spark, output_bucket_name)
+    else:
+        logger.info("Processing Song Data")
+        songs, artists = process_song_data(
+            spark, song_data_path, output_bucket_name, metrics)
     logger.info("Processing Log Data")
     process_log_data(
-        spark, log_data_path, output_bucket_name, songs, artists)
+        spark, log_data_path, output_bucket_name, songs, artists, metrics, broadcast_threshold_mb, months)
+    metrics.write(*metrics_paths)
     logger.info("Sparkify ETL is completed")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sparkify ETL")
+    parser.add_argument("--start-date", type=date.fromisoformat,
+                        help="incremental run: first day (YYYY-MM-DD) of the new logs")
+    parser.add_argument("--end-date", type=date.fromisoformat,
+                        help="incremental run: last day (YYYY-MM-DD) of the new logs, the start date by default")
+    args = parser.parse_args()
+    if args.end_date and not args.start_date:
+        parser.error("--end-date requires --start-date")
+    months = get_months(args.start_date, args.end_date or args.start_date) if args.start_date else None
+
     APP = 'sparkify'
     STAGE = 'dev'
     setup_aws_env()
     output_bucket_name = f'{APP}-{STAGE}'
     setup_output(output_bucket_name, bucket_exists=True)
 
-    song_data_path, log_data_path = get_raw_data_location(dry_run=True)
-    run_sparkify_etl(output_bucket_name, song_data_path, log_data_path)
+    song_data_path, log_data_path = get_raw_data_location(dry_run=True, months=months)
+    run_sparkify_etl(output_bucket_name, song_data_path, log_data_path, months=months)
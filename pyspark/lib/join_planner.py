@@ -0,0 +1,137 @@
+import logging
+
+from pyspark.sql.functions import broadcast, col, lower, trim, round
+
+from lib.spark_util import estimated_size_bytes
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+BROADCAST_THRESHOLD_MB = 64
+DURATION_PRECISION = 2
+KEY_COLUMNS = ["title_key", "artist_key", "duration_key"]
+
+
+def normalized_text(column):
+    """
+    Match key of a free text column: trimmed and lower cased
+
+    Arguments:
+        column {str|Column} -- Text column
+
+    Returns:
+        {Column} -- Normalized column
+    """
+    return lower(trim(col(column) if isinstance(column, str) else column))
+
+
+def song_key(title, artist, duration, precision: int = DURATION_PRECISION):
+    """
+    Normalized song match key. The duration is rounded, as exact equality on `double`
+    misses plays whose length was serialized with a different precision than the song
+
+    Arguments:
+        title {str|Column} -- Song title column
+        artist {str|Column} -- Artist name column
+        duration {str|Column} -- Duration in seconds column
+
+    Keyword Arguments:
+        precision {int} -- Decimals the duration is rounded to (default: {DURATION_PRECISION})
+
+    Returns:
+        {list} -- title_key, artist_key and duration_key columns
+    """
+    duration = col(duration) if isinstance(duration, str) else duration
+    return [normalized_text(title).alias("title_key"),
+            normalized_text(artist).alias("artist_key"),
+            round(duration, precision).alias("duration_key")]
+
+
+def broadcast_if_small(df, threshold_mb: int = BROADCAST_THRESHOLD_MB, name: str = "dataframe"):
+    """
+    Broadcast hint on a dataframe estimated to fit under the threshold, so joining it does not
+    shuffle the other side. Without an estimate Spark decides with autoBroadcastJoinThreshold
+
+    Arguments:
+        df {DataFrame} -- Dataframe to broadcast
+
+    Keyword Arguments:
+        threshold_mb {int} -- Largest size broadcast in MB (default: {BROADCAST_THRESHOLD_MB})
+        name {str} -- Name used in the logs (default: {"dataframe"})
+
+    Returns:
+        {DataFrame} -- The dataframe, with a broadcast hint if it fits
+    """
+    size_bytes = estimated_size_bytes(df)
+    if size_bytes is None or size_bytes > threshold_mb * 1024 * 1024:
+        logger.info(f"Not broadcasting `{name}`: estimated size {size_bytes} bytes, threshold {threshold_mb}MB")
+        return df
+    logger.info(f"Broadcasting `{name}`: estimated size {size_bytes / 1024 / 1024:.1f}MB")
+    return broadcast(df)
+
+
+def build_song_lookup(songs_df, artists_df, threshold_mb: int = BROADCAST_THRESHOLD_MB,
+                      precision: int = DURATION_PRECISION):
+    """
+    Compact song lookup: the song match key with the song and artist ids, one row per key
+
+    Arguments:
+        songs_df {DataFrame} -- Songs table
+        artists_df {DataFrame} -- Artists table
+
+    Keyword Arguments:
+        threshold_mb {int} -- Largest size broadcast in MB (default: {BROADCAST_THRESHOLD_MB})
+        precision {int} -- Decimals the duration is rounded to (default: {DURATION_PRECISION})
+
+    Returns:
+        {DataFrame} -- title_key, artist_key, duration_key, song_id, artist_id
+    """
+    artist_names = broadcast_if_small(artists_df.select("artist_id", "name"), threshold_mb, "artist names")
+    return (songs_df
+            .join(artist_names, "artist_id")
+            .select(*song_key("title", "name", "duration", precision), "song_id", "artist_id")
+            .dropDuplicates(KEY_COLUMNS)
+            )
+
+
+def join_song_lookup(events_df, lookup_df, threshold_mb: int = BROADCAST_THRESHOLD_MB,
+                     precision: int = DURATION_PRECISION):
+    """
+    Left join the events to the song lookup on the normalized key, broadcasting the lookup
+    when it fits under the threshold so the events are never shuffled
+
+    Arguments:
+        events_df {DataFrame} -- Events with song, artist and length columns
+        lookup_df {DataFrame} -- Lookup built by `build_song_lookup`
+
+    Keyword Arguments:
+        threshold_mb {int} -- Largest size broadcast in MB (default: {BROADCAST_THRESHOLD_MB})
+        precision {int} -- Decimals the duration is rounded to (default: {DURATION_PRECISION})
+
+    Returns:
+        {DataFrame} -- Events with song_id and artist_id, null when no song matches
+    """
+    lookup_df = broadcast_if_small(lookup_df, threshold_mb, "song lookup")
+    return (events_df
+            .select("*", *song_key("song", "artist", "length", precision))
+            .join(lookup_df, KEY_COLUMNS, "left")
+            .drop(*KEY_COLUMNS)
+            )
+
+
+def count_shuffles(df):
+    """
+    Number of shuffles in the physical plan of a dataframe, broadcasts and reused exchanges excluded
+
+    Arguments:
+        df {DataFrame} -- Dataframe
+
+    Returns:
+        {int} -- Number of shuffle exchanges, None if the plan is not available
+    """
+    try:
+        plan = df._jdf.queryExecution().executedPlan().toString()
+    except Exception:
+        return None
+    return sum(1 for line in plan.splitlines()
+               if "Exchange" in line and "BroadcastExchange" not in line and "ReusedExchange" not in line)
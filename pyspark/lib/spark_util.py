@@ -0,0 +1,292 @@
+import math
+import logging
+
+from pyspark import StorageLevel
+from pyspark.sql import SparkSession
+from pyspark.sql.dataframe import DataFrame
+from pyspark.sql.types import StructType
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+TARGET_FILE_MB = 128
+MAX_RECORDS_PER_FILE = 1000000
+UNKNOWN_SIZE_BYTES = 2 ** 63 - 1
+
+
+def create_spark_session():
+    """
+    Create a Spark session
+
+    Returns:
+        {SparkSession} -- Spark session with the S3 connector
+    """
+    spark = SparkSession \
+        .builder \
+        .config("spark.jars.packages", "org.apache.hadoop:hadoop-aws:2.7.0") \
+        .getOrCreate()
+    return spark
+
+
+def get_file_system(spark, path: str):
+    """
+    Hadoop file system of a location, the one Spark reads and writes it with
+
+    Arguments:
+        spark {SparkSession} -- Spark Session
+        path {str} -- Location
+
+    Returns:
+        {tuple} -- FileSystem, Path
+    """
+    hadoop_path = spark.sparkContext._jvm.org.apache.hadoop.fs.Path(path)
+    return hadoop_path.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration()), hadoop_path
+
+
+def existing_locations(spark, locations: list):
+    """
+    Locations that exist, as reading a missing one fails the whole read with "Path does not exist"
+
+    Arguments:
+        spark {SparkSession} -- Spark Session
+        locations {list} -- Locations, without wildcards
+
+    Returns:
+        {list} -- The existing locations, in the same order
+    """
+    existing = []
+    for location in locations:
+        file_system, path = get_file_system(spark, location)
+        if file_system.exists(path):
+            existing.append(location)
+        else:
+            logger.info(f"Skipping `{location}`, it does not exist")
+    return existing
+
+
+def estimated_size_bytes(df):
+    """
+    Size of a dataframe as estimated by the Catalyst optimizer, exact for persisted frames
+    already materialized. Spark reports an unknown size as the largest long, returned as None
+
+    Arguments:
+        df {DataFrame} -- Dataframe
+
+    Returns:
+        {int} -- Estimated size in bytes, None if the statistics are not available
+    """
+    try:
+        size_bytes = int(df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes().toString())
+    except Exception:
+        return None
+    return size_bytes if size_bytes < UNKNOWN_SIZE_BYTES else None
+
+
+def estimated_row_bytes(df):
+    """
+    Size of a row of a dataframe, from the optimizer row count when it is known and from the
+    default sizes of the schema types otherwise
+
+    Arguments:
+        df {DataFrame} -- Dataframe
+
+    Returns:
+        {int} -- Estimated bytes per row, None if the statistics are not available
+    """
+    try:
+        row_count = df._jdf.queryExecution().optimizedPlan().stats().rowCount()
+        size_bytes = estimated_size_bytes(df)
+        if row_count.isDefined() and size_bytes is not None:
+            return max(1, size_bytes // max(1, int(row_count.get().toString())))
+        return max(1, int(df._jdf.schema().defaultSize()))
+    except Exception:
+        return None
+
+
+def target_partitions(df, target_file_mb: int = TARGET_FILE_MB):
+    """
+    Number of write tasks handling about `target_file_mb` of data each, from the estimated size of
+    a dataframe. The estimate is the in memory size, parquet files are usually a few times smaller
+
+    Arguments:
+        df {DataFrame} -- Dataframe
+
+    Keyword Arguments:
+        target_file_mb {int} -- Target file size in MB (default: {TARGET_FILE_MB})
+
+    Returns:
+        {int} -- Number of partitions, None without a size estimate
+    """
+    size_bytes = estimated_size_bytes(df)
+    if size_bytes is None:
+        return None
+    return max(1, math.ceil(size_bytes / (target_file_mb * 1024 * 1024)))
+
+
+def target_records_per_file(df, target_file_mb: int = TARGET_FILE_MB, max_records_per_file: int = MAX_RECORDS_PER_FILE):
+    """
+    Records per file giving files of about `target_file_mb`, from the estimated size of a row
+
+    Arguments:
+        df {DataFrame} -- Dataframe
+
+    Keyword Arguments:
+        target_file_mb {int} -- Target file size in MB (default: {TARGET_FILE_MB})
+        max_records_per_file {int} -- Upper bound, 0 for none (default: {MAX_RECORDS_PER_FILE})
+
+    Returns:
+        {int} -- Records per file, `max_records_per_file` without a row size estimate
+    """
+    row_bytes = estimated_row_bytes(df)
+    if row_bytes is None:
+        return max_records_per_file
+    records = max(1, target_file_mb * 1024 * 1024 // row_bytes)
+    return min(records, max_records_per_file) if max_records_per_file else records
+
+
+class SparkDF(object):
+    """
+    Wrapper of a Spark dataframe that knows how many downstream consumers will read it.
+
+    Every action on an unpersisted dataframe recomputes its whole lineage, down to reading and
+    parsing the raw JSON. A frame declared with more than one consumer is persisted at
+    `storage_level` before its first action, so it is computed once, and unpersisted as soon as
+    its last consumer is done with it, freeing the executors storage memory for the next frames.
+
+    A consumer is either a write of the frame itself or a `DerivativeDF` built from it with
+    the frame in its `sources`, which releases it once the derivative is materialized.
+    """
+    storage_level = StorageLevel.MEMORY_AND_DISK
+
+    def __init__(self, spark_session, consumers: int = 1, storage_level: StorageLevel = None):
+        self.spark = spark_session
+        self.consumers = 0
+        self.persisted = False
+        if storage_level is not None:
+            self.storage_level = storage_level
+        self.add_consumers(consumers)
+
+    @classmethod
+    def set_storage_level(cls, storage_level: str):
+        """
+        Set the default storage level of the frames persisted for reuse
+
+        Arguments:
+            storage_level {str} -- Name of a `pyspark.StorageLevel`, like MEMORY_AND_DISK_SER
+        """
+        cls.storage_level = getattr(StorageLevel, storage_level)
+
+    @property
+    def name(self):
+        return getattr(self, "location", None) or type(self).__name__
+
+    def add_consumers(self, number: int = 1):
+        """
+        Declare more downstream consumers of the frame, persisting it once it has more than one.
+        Must be called before the first action reading the frame for the cache to be used
+
+        Keyword Arguments:
+            number {int} -- Number of new consumers (default: {1})
+
+        Returns:
+            {SparkDF} -- The frame itself
+        """
+        self.consumers += number
+        if self.consumers > 1 and not self.persisted:
+            self.df = self.df.persist(self.storage_level)
+            self.persisted = True
+            logger.info(f"Persisting `{self.name}` for {self.consumers} consumers at {self.storage_level}")
+        return self
+
+    def release(self):
+        """
+        Mark one consumer as done, unpersisting the frame when it was the last one
+        """
+        self.consumers -= 1
+        if self.consumers <= 0 and self.persisted:
+            self.df.unpersist()
+            self.persisted = False
+            logger.info(f"Unpersisted `{self.name}`, its last consumer is done")
+
+    def _load_json_data(self):
+        locations = [self.location] if isinstance(self.location, str) else self.location
+        return self.spark.read.json([f"{location}/*.json" for location in locations], schema=self.schema)
+
+    def _write_to_parquet(self, s3_output_path: str, mode: str = 'overwrite', partitions: list = [],
+                          dynamic_partitions: bool = False, target_file_mb: int = TARGET_FILE_MB,
+                          max_records_per_file: int = MAX_RECORDS_PER_FILE):
+        """
+        Write the frame as parquet, releasing one of its consumers
+
+        The frame is repartitioned by the partition columns first, so each output partition is
+        written by a single task instead of one small file per task holding its rows, with about
+        `target_file_mb` of data per task. The files of an output partition larger than that are
+        split every `target_file_mb`, through a maxRecordsPerFile derived from the estimated row size
+
+        Arguments:
+            s3_output_path {str} -- Output location
+
+        Keyword Arguments:
+            mode {str} -- Save mode (default: {'overwrite'})
+            partitions {list} -- Partition columns (default: {[]})
+            dynamic_partitions {bool} -- Overwrite only the partitions present in the frame, leaving the
+                                         others untouched, instead of the whole output (default: {False})
+            target_file_mb {int} -- Target file size and data per write task in MB, None to keep the
+                                    current partitioning and files (default: {TARGET_FILE_MB})
+            max_records_per_file {int} -- Largest number of records of a file, 0 for no limit
+                                          (default: {MAX_RECORDS_PER_FILE})
+        """
+        df = self.df
+        records_per_file = max_records_per_file
+        if target_file_mb:
+            number_partitions = target_partitions(df, target_file_mb)
+            records_per_file = target_records_per_file(df, target_file_mb, max_records_per_file)
+            if partitions:
+                df = df.repartition(number_partitions, *partitions) if number_partitions else df.repartition(*partitions)
+            elif number_partitions:
+                df = df.repartition(number_partitions)
+        writer = df.write.option("maxRecordsPerFile", records_per_file)
+        if dynamic_partitions:
+            writer = writer.option("partitionOverwriteMode", "dynamic")
+        writer.parquet(
+            s3_output_path,
+            mode=mode,
+            partitionBy=partitions
+        )
+        self.release()
+
+
+class RawDF(SparkDF):
+    """
+    Raw JSON data of one location or of a list of locations. Transformations shared by all the consumers, like filters, should be applied
+    to `df` before `add_consumers` persists it
+    """
+
+    def __init__(self, spark_session, location, data_schema: StructType, consumers: int = 1,
+                 storage_level: StorageLevel = None):
+        self.spark = spark_session
+        self.location = location
+        self.schema = data_schema
+        self.df = self._load_json_data()
+        super().__init__(spark_session, consumers=consumers, storage_level=storage_level)
+
+
+class DerivativeDF(SparkDF):
+    """
+    Dataframe derived from the frames in `sources`. Each source is released once, when this
+    frame is materialized: after its first consumer if it is persisted (later reads hit its own
+    cache), after its last consumer otherwise
+    """
+
+    def __init__(self, df: DataFrame, sources: list = (), consumers: int = 1, storage_level: StorageLevel = None):
+        self.df = df
+        self.sources = list(sources)
+        super().__init__(None, consumers=consumers, storage_level=storage_level)
+
+    def release(self):
+        persisted = self.persisted
+        super().release()
+        if self.sources and (persisted or self.consumers <= 0):
+            for source in self.sources:
+                source.release()
+            self.sources = []
@@ -0,0 +1,124 @@
+from functools import lru_cache
+
+import pandas as pd
+
+from pyspark.sql import Column
+from pyspark.sql.functions import (col,
+                                   floor,
+                                   year,
+                                   month,
+                                   dayofmonth,
+                                   hour,
+                                   weekofyear,
+                                   dayofweek
+                                   )
+from pyspark.sql.types import TimestampType
+
+
+def _column(column):
+    return column if isinstance(column, Column) else col(column)
+
+
+def epoch_ms_to_timestamp(column):
+    """
+    Native Spark expression converting epoch milliseconds to a timestamp truncated to the second,
+    as the former `get_datetime` Python UDF did, without leaving the JVM
+
+    Arguments:
+        column {str|Column} -- Epoch milliseconds column
+
+    Returns:
+        {Column} -- Timestamp column
+    """
+    return floor(_column(column) / 1000).cast(TimestampType())
+
+
+def time_columns(start_time="start_time"):
+    """
+    Native Spark expressions of every time dimension field, derived from a timestamp column
+
+    Keyword Arguments:
+        start_time {str|Column} -- Timestamp column (default: {"start_time"})
+
+    Returns:
+        {dict} -- Field name to its column expression
+    """
+    start_time = _column(start_time)
+    return {
+        "hour": hour(start_time),
+        "day": dayofmonth(start_time),
+        "week": weekofyear(start_time),
+        "month": month(start_time),
+        "year": year(start_time),
+        "weekday": dayofweek(start_time),
+    }
+
+
+def with_time_columns(df, start_time: str = "start_time", fields: list = None):
+    """
+    Adds the time dimension fields to a dataframe in a single projection
+
+    Arguments:
+        df {DataFrame} -- Dataframe with a timestamp column
+
+    Keyword Arguments:
+        start_time {str} -- Timestamp column (default: {"start_time"})
+        fields {list} -- Fields to add, all the `time_columns` fields if None (default: {None})
+
+    Returns:
+        {DataFrame} -- Dataframe with the time fields
+    """
+    expressions = time_columns(start_time)
+    return df.select("*", *(expressions[field].alias(field) for field in fields or expressions))
+
+
+def in_months(months: list, start_time="start_time"):
+    """
+    Native Spark predicate keeping the rows of the given months
+
+    Arguments:
+        months {list} -- (year, month) tuples
+
+    Keyword Arguments:
+        start_time {str|Column} -- Timestamp column (default: {"start_time"})
+
+    Returns:
+        {Column} -- Boolean column
+    """
+    start_time = _column(start_time)
+    return (year(start_time) * 100 + month(start_time)).isin([year_ * 100 + month_ for year_, month_ in months])
+
+
+@lru_cache(maxsize=None)
+def vectorized_udf(function, return_type):
+    """
+    Fallback for derivations that cannot be written as Spark expressions: a pandas UDF exchanging
+    whole Arrow batches with the Python workers instead of one pickled row at a time.
+    Created on first use, so this module does not need pyarrow otherwise
+
+    Arguments:
+        function {callable} -- pd.Series -> pd.Series
+        return_type {DataType} -- Spark type of the result
+
+    Returns:
+        {callable} -- UDF applied to columns
+    """
+    from pyspark.sql.functions import pandas_udf
+    return pandas_udf(function, return_type)
+
+
+def _pandas_epoch_ms_to_timestamp(ts: pd.Series) -> pd.Series:
+    return pd.to_datetime(ts // 1000, unit="s", utc=True)
+
+
+def pandas_epoch_ms_to_timestamp(column):
+    """
+    `epoch_ms_to_timestamp` as a pandas UDF, kept to benchmark the vectorized Python path
+
+    Arguments:
+        column {str|Column} -- Epoch milliseconds column
+
+    Returns:
+        {Column} -- Timestamp column
+    """
+    return vectorized_udf(_pandas_epoch_ms_to_timestamp, TimestampType())(_column(column))
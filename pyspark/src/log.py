@@ -1,18 +1,9 @@
 import logging
-from datetime import datetime
 
 from pyspark.sql import Window
-from pyspark.sql.functions import (udf,
-                                   col,
-                                   year,
-                                   month,
-                                   dayofmonth,
-                                   hour,
-                                   weekofyear,
-                                   date_format,
-                                   dayofweek,
+from pyspark.sql.functions import (col,
                                    max,
-                                   monotonically_increasing_id
+                                   xxhash64
                                    )
 
 from pyspark.sql.types import (
@@ -21,17 +12,21 @@ from pyspark.sql.types import (
     StringType,
     DoubleType,
     IntegerType,
-    TimestampType
 )
 
 from lib.spark_util import DerivativeDF, RawDF
+from lib.metrics import RunMetrics
+from lib.time_columns import epoch_ms_to_timestamp, with_time_columns, in_months
+from lib.join_planner import BROADCAST_THRESHOLD_MB, build_song_lookup, join_song_lookup, count_shuffles
 
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
-def process_log_data(spark, s3_raw_data_path: str, output_bucket_name: str, songs: DerivativeDF, artists: DerivativeDF):
+def process_log_data(spark, s3_raw_data_path: str, output_bucket_name: str, songs: DerivativeDF, artists: DerivativeDF,
+                     metrics: RunMetrics = None, broadcast_threshold_mb: int = BROADCAST_THRESHOLD_MB,
+                     months: list = None):
     """
     Processes log data creating the dimnensionl tables associated with it
 
@@ -45,13 +40,21 @@ def process_log_data(spark, s3_raw_data_path: str, output_bucket_name: str, song
 
     Arguments:
         spark {SparkSession} -- Spark Session
-        s3_raw_data_path {str} -- Location of raw log data in S3
+        s3_raw_data_path {str|list} -- Location(s) of raw log data in S3
         output_bucket_name {str} -- Output bucket for processed data
         songs {DerivativeDF} -- Songs derivative DF
         artists {DerivativeDF} -- Artists derivative DF
 
+    Keyword Arguments:
+        metrics {RunMetrics} -- Run metrics the writes of each table are measured in (default: {None})
+        broadcast_threshold_mb {int} -- Largest song lookup broadcast to the songplays join in MB
+                                        (default: {BROADCAST_THRESHOLD_MB})
+        months {list} -- (year, month) tuples of an incremental run: only the events of these months
+                         are kept and only their partitions of time and songplays are overwritten,
+                         users is not rebuilt. All the data and tables if None (default: {None})
+
     Returns:
-        {DerivativeDF} -- users, time, songsplay
+        {DerivativeDF} -- users (None in incremental runs), time, songsplay
     """
 
     def get_log_schema():
@@ -82,11 +85,6 @@ def process_log_data(spark, s3_raw_data_path: str, output_bucket_name: str, song
             StructField("userId", StringType(), True)
         ])
 
-    get_datetime = udf(
-        lambda x: datetime.fromtimestamp(x / 1000).replace(microsecond=0),
-        TimestampType()
-    )
-
     def create_users_table(log_raw, output_bucket_name: str):
         """
         Create users pyspark dataframe
@@ -111,7 +109,8 @@ def process_log_data(spark, s3_raw_data_path: str, output_bucket_name: str, song
                                  col("lastName").alias("last_name"),
                                  "gender",
                                  "level"
-                             )
+                             ),
+                             sources=[log_raw]
                              )
         users._write_to_parquet(
             s3_output_path=f"s3://{output_bucket_name}/users",
@@ -131,20 +130,15 @@ def process_log_data(spark, s3_raw_data_path: str, output_bucket_name: str, song
         Returns:
             {DerivativeDF} -- time derivate dataframe
         """
-        time = DerivativeDF(log_raw.df
-                            .withColumn("hour", hour("start_time"))
-                            .withColumn("day", dayofmonth("start_time"))
-                            .withColumn("week", weekofyear("start_time"))
-                            .withColumn("month", month("start_time"))
-                            .withColumn("year", year("start_time"))
-                            .withColumn("weekday", dayofweek("start_time"))
-                            .select("start_time", "hour", "day", "week", "month", "year", "weekday")
-                            .distinct()
+        time = DerivativeDF(with_time_columns(log_raw.df.select("start_time").distinct())
+                            .select("start_time", "hour", "day", "week", "month", "year", "weekday"),
+                            sources=[log_raw]
                             )
 
         time._write_to_parquet(
             s3_output_path=f"s3://{output_bucket_name}/time",
-            partitions=["year", "month"]
+            partitions=["year", "month"],
+            dynamic_partitions=months is not None
         )
 
         return time
@@ -153,6 +147,10 @@ def process_log_data(spark, s3_raw_data_path: str, output_bucket_name: str, song
         """
         Create sogsplay pyspark dataframe
 
+        The events are matched to a compact lookup of the songs on a normalized key (title, artist
+        name, rounded duration), broadcast when it fits under `broadcast_threshold_mb`. Year and month
+        are derived from start_time, so the only shuffle left is the deduplication of the lookup
+
         Arguments:
             log_raw {DerivativeDF} -- Log helping class for pyspak dtaframes
             output_bucket_name {str} -- Output in S3 location
@@ -160,24 +158,13 @@ def process_log_data(spark, s3_raw_data_path: str, output_bucket_name: str, song
         Returns:
             {DerivativeDF} -- songsplay derivate dataframe
         """
-        songs_temp = (
-            songs.df
-            .join(artists.df, "artist_id", "full")
-            .select("song_id", "title", "artist_id", "name", "duration")
-        )
+        song_lookup = build_song_lookup(songs.df, artists.df, broadcast_threshold_mb)
+        songplays_temp = join_song_lookup(log_raw.df, song_lookup, broadcast_threshold_mb)
 
-        songplays_temp = log_raw.df.join(
-            songs_temp,
-            [
-                log_raw.df.song == songs_temp.title,
-                log_raw.df.artist == songs_temp.name,
-                log_raw.df.length == songs_temp.duration
-            ],
-            "left"
-        )
-
-        songplays = DerivativeDF(songplays_temp
-                                 .join(time.df, "start_time", "left")
+        # Stable across runs, unlike monotonically_increasing_id, so the months rewritten by
+        # incremental runs keep the ids of a full run and never collide with the other months
+        songplay_id = xxhash64("start_time", "userId", "sessionId", "itemInSession")
+        songplays = DerivativeDF(with_time_columns(songplays_temp, fields=["year", "month"])
                                  .select(
                                      "start_time",
                                      col("userId").alias("user_id"),
@@ -188,29 +175,47 @@ def process_log_data(spark, s3_raw_data_path: str, output_bucket_name: str, song
                                      "location",
                                      col("userAgent").alias("user_agent"),
                                      "year",
-                                     "month"
-                                 )
-                                 .withColumn("songplay_id", monotonically_increasing_id())
+                                     "month",
+                                     songplay_id.alias("songplay_id")
+                                 ),
+                                 sources=[log_raw, songs, artists]
                                  )
+        shuffles = count_shuffles(songplays.df)
+        if shuffles is not None and shuffles > 1:
+            logger.warning(f"`songplays` plan has {shuffles} shuffles, the song lookup is not broadcast")
 
         songplays._write_to_parquet(
             s3_output_path=f"s3://{output_bucket_name}/songplays",
-            partitions=["year", "month"]
+            partitions=["year", "month"],
+            dynamic_partitions=months is not None
         )
 
         return songplays
 
+    metrics = metrics or RunMetrics('sparkify_spark')
     logger.info(f"Reading and Processing `{s3_raw_data_path}`")
     log_raw = RawDF(spark, s3_raw_data_path, get_log_schema())
     log_raw.df = log_raw.df.filter(col("page") == "NextSong")
-    log_raw.df = log_raw.df.withColumn("start_time", get_datetime("ts"))
-
-    logger.info("Processing and writting `users` data")
-    users = create_users_table(log_raw, output_bucket_name)
+    log_raw.df = log_raw.df.withColumn("start_time", epoch_ms_to_timestamp("ts"))
+    if months is not None:
+        # Events a file holds outside its month would overwrite the partition of another month
+        log_raw.df = log_raw.df.filter(in_months(months))
+    # Read by the users (full runs only), time and songplays tables, persisted once filtered
+    log_raw.add_consumers(1 if months is not None else 2)
+
+    users = None
+    if months is None:
+        logger.info("Processing and writting `users` data")
+        with metrics.stage('write_users'):
+            users = create_users_table(log_raw, output_bucket_name)
+    else:
+        logger.info("Skipping `users`, it is only rebuilt by full runs")
     logger.info("Processing and writting `time` data")
-    time = create_time_table(log_raw, output_bucket_name)
+    with metrics.stage('write_time'):
+        time = create_time_table(log_raw, output_bucket_name)
     logger.info("Processing and writting `songplays` data")
-    songplays = create_songsplay_table(
-        log_raw, songs, artists, output_bucket_name)
+    with metrics.stage('write_songplays'):
+        songplays = create_songsplay_table(
+            log_raw, songs, artists, output_bucket_name)
 
     return users, time, songplays
@@ -10,12 +10,13 @@ from pyspark.sql.types import (
 )
 from pyspark.sql.functions import col
 from lib.spark_util import DerivativeDF, RawDF
+from lib.metrics import RunMetrics
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
-def process_song_data(spark, s3_raw_data_path: str, output_bucket_name: str):
+def process_song_data(spark, s3_raw_data_path: str, output_bucket_name: str, metrics: RunMetrics = None):
     """
     Handles the creation of the central dimensional table based on the raw song data
 
@@ -27,6 +28,9 @@ def process_song_data(spark, s3_raw_data_path: str, output_bucket_name: str):
         spark {SparkSession} -- Spark Session
         s3_raw_data_path {str} -- S3 path of raw songs data JSON files
         output_bucket_name {str} -- Output bucket name
+
+    Keyword Arguments:
+        metrics {RunMetrics} -- Run metrics the writes of each table are measured in (default: {None})
     """
 
     def get_song_schema():
@@ -57,10 +61,11 @@ def process_song_data(spark, s3_raw_data_path: str, output_bucket_name: str):
             output_bucket_name {str} -- Output in S3 location
 
         Returns:
-            {DerivativeDF} -- songs derivate dataframe
+            {DerivativeDF} -- songs derivate dataframe, persisted for the songplays table
         """
         songs = DerivativeDF(song_raw.df.select(
-            "song_id", "title", "artist_id", "year", "duration"))
+            "song_id", "title", "artist_id", "year", "duration"),
+            sources=[song_raw], consumers=2)
         songs._write_to_parquet(
             s3_output_path=f"s3://{output_bucket_name}/songs",
             partitions=["year", "artist_id"]
@@ -77,7 +82,7 @@ def process_song_data(spark, s3_raw_data_path: str, output_bucket_name: str):
             output_bucket_name {str} -- Output in S3 location
 
         Returns:
-            {DerivativeDF} -- artists derivate dataframe
+            {DerivativeDF} -- artists derivate dataframe, persisted for the songplays table
         """
         artists = DerivativeDF(song_raw.df
                                .select(
@@ -86,7 +91,8 @@ def process_song_data(spark, s3_raw_data_path: str, output_bucket_name: str):
                                    col("artist_location").alias("location"),
                                    col("artist_latitude").alias("latitude"),
                                    col("artist_longitude").alias("longitude"))
-                               .distinct()
+                               .distinct(),
+                               sources=[song_raw], consumers=2
                                )
         artists._write_to_parquet(
             s3_output_path=f"s3://{output_bucket_name}/artists",
@@ -95,11 +101,33 @@ def process_song_data(spark, s3_raw_data_path: str, output_bucket_name: str):
 
         return artists
 
+    metrics = metrics or RunMetrics('sparkify_spark')
     logger.info(f"Reading and Processing `{s3_raw_data_path}`")
-    song_raw = RawDF(spark, s3_raw_data_path, get_song_schema())
+    # Read by the songs and artists tables
+    song_raw = RawDF(spark, s3_raw_data_path, get_song_schema(), consumers=2)
     logger.info("Processing and writting `songs` data")
-    songs = create_song_table(song_raw, output_bucket_name)
+    with metrics.stage('write_songs'):
+        songs = create_song_table(song_raw, output_bucket_name)
     logger.info("Processing and writting `artists` data")
-    artists = create_artists_table(song_raw, output_bucket_name)
+    with metrics.stage('write_artists'):
+        artists = create_artists_table(song_raw, output_bucket_name)
+
+    return songs, artists
+
+
+def load_song_tables(spark, output_bucket_name: str):
+    """
+    Reads the songs and artists tables written by a previous full run, used by the
+    incremental mode to join the new plays without reprocessing the raw song data
 
+    Arguments:
+        spark {SparkSession} -- Spark Session
+        output_bucket_name {str} -- Output bucket name
+
+    Returns:
+        {tuple} -- songs, artists derivative dataframes
+    """
+    logger.info(f"Reading `songs` and `artists` from `{output_bucket_name}`")
+    songs = DerivativeDF(spark.read.parquet(f"s3://{output_bucket_name}/songs"))
+    artists = DerivativeDF(spark.read.parquet(f"s3://{output_bucket_name}/artists"))
     return songs, artists
@@ -1,27 +1,37 @@
 import configparser
 import psycopg2
 from sql_queries import copy_table_queries, insert_table_queries
+from metrics import RunMetrics
 
 
-def load_staging_tables(cur, conn):
+def run_stage(metrics, stage_name, cur, conn, query):
+    """Execute and commit one query as a measured stage, recording the rows it affected when reported."""
+    with metrics.stage(stage_name) as stage:
+        cur.execute(query)
+        conn.commit()
+        if cur.rowcount >= 0:
+            stage.rows_out = cur.rowcount
+
+
+def load_staging_tables(cur, conn, metrics=None):
+    metrics = metrics or RunMetrics('sparkify_redshift')
     for query in copy_table_queries:
         try:
             table_name = query.split(' ')[1]
             print(f'\t-Loading Staging Table `{table_name}`')
-            cur.execute(query)
-            conn.commit()
+            run_stage(metrics, f'copy_{table_name}', cur, conn, query)
         except Exception as e:
             print(query)
             raise e
 
 
-def insert_tables(cur, conn):
+def insert_tables(cur, conn, metrics=None):
+    metrics = metrics or RunMetrics('sparkify_redshift')
     for query in insert_table_queries:
         try:
             table_name = query.split(' ')[2]
             print(f'\t-Inserting Into Analytics Table `{table_name}`')
-            cur.execute(query)
-            conn.commit()
+            run_stage(metrics, f'insert_{table_name}', cur, conn, query)
         except Exception as e:
             print(query)
             raise e
@@ -41,15 +51,17 @@ def main():
         )
     print('Connected Succesfully to Redshift')
     cur = conn.cursor()
+    metrics = RunMetrics('sparkify_redshift')
     
     print('Sparkify ETL Starting')
     print('Loading Staging Tables from S3 to Redshift')
-    load_staging_tables(cur, conn)
+    load_staging_tables(cur, conn, metrics)
     
     print('Transform Tables From Staging to Analytics Format')
-    insert_tables(cur, conn)
+    insert_tables(cur, conn, metrics)
 
     conn.close()
+    metrics.write(*config.get('METRICS', 'PATHS', fallback='etl_metrics.json').split(','))
     print('Sparkify ETL Ended')
 
 
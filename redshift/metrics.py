@@ -0,0 +1,164 @@
+# Generated from postgres/metrics.py by postgres/sync_metrics.py, do not edit: change the source and rerun it.
+import os
+import json
+import time
+import resource
+import logging
+import functools
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+PROMETHEUS_METRICS = (
+    ('wall_seconds', 'Wall clock time of the stage in seconds.'),
+    ('cpu_seconds', 'CPU time (user + system) of the process during the stage in seconds.'),
+    ('rows_in', 'Rows read by the stage.'),
+    ('rows_out', 'Rows written by the stage.'),
+    ('bytes', 'Bytes processed by the stage.'),
+    ('peak_rss_bytes', 'Peak resident set size of the process at the end of the stage in bytes.'),
+    ('failed', 'Whether the stage failed (1) or completed (0).'),
+)
+
+
+def peak_rss_bytes():
+    """Peak resident set size of the process (ru_maxrss is reported in KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _json_value(value):
+    """Plain Python value of the NumPy scalars a stage may be given as rows or bytes."""
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+class Stage(object):
+    """
+    Measurements of one ETL stage. Wall time, CPU time and peak RSS are filled in by
+    `RunMetrics.stage`, rows and bytes by the code running the stage.
+    """
+
+    def __init__(self, name: str, rows_in: int = None, bytes: int = None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.bytes = bytes
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_bytes = None
+        self.failed = False
+
+    def to_dict(self):
+        return {'stage': self.name, 'wall_seconds': self.wall_seconds, 'cpu_seconds': self.cpu_seconds,
+                'rows_in': self.rows_in, 'rows_out': self.rows_out, 'bytes': self.bytes,
+                'peak_rss_bytes': self.peak_rss_bytes, 'failed': self.failed}
+
+
+class RunMetrics(object):
+    """
+    Per stage instrumentation of one ETL run, exported as JSON or as a Prometheus textfile.
+
+    A stage costs two clock reads and one `getrusage` call on entry and exit, so it is cheap
+    enough to leave on for every run. CPU time is the time of this process, all its threads
+    included; work done in other processes (reader pools, the database, Spark executors) is not counted.
+
+    Example:
+        metrics = RunMetrics('sparkify_postgres')
+        with metrics.stage('read_logs') as stage:
+            logs_df = get_json_dataframe(...)
+            stage.rows_out = logs_df.shape[0]
+        metrics.write('etl_metrics.json', 'etl_metrics.prom')
+    """
+
+    def __init__(self, job: str, labels: dict = None, profiler=None):
+        self.job = job
+        self.labels = labels or {}
+        self.profiler = profiler
+        self.started_at = time.time()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int = None, bytes: int = None):
+        """
+        Measure the enclosed block as a stage, yielding its `Stage` to record rows and bytes.
+        A stage raising an exception is recorded as failed and the exception propagates.
+        With a `profiler` (see `profiling.StageProfiler`) the stage is profiled too.
+        """
+        stage = Stage(name, rows_in, bytes)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            with self.profiler.profile(name) if self.profiler else nullcontext():
+                yield stage
+        except BaseException:
+            stage.failed = True
+            raise
+        finally:
+            stage.wall_seconds = time.perf_counter() - wall_start
+            stage.cpu_seconds = time.process_time() - cpu_start
+            stage.peak_rss_bytes = peak_rss_bytes()
+            self.stages.append(stage)
+            logger.info(f"Stage {name}: {stage.wall_seconds:.2f}s wall, {stage.cpu_seconds:.2f}s CPU"
+                        + (f", {stage.rows_out} rows" if stage.rows_out is not None else ""))
+
+    def timed(self, name: str = None, rows=len):
+        """
+        Decorator measuring every call of a function as a stage. `rows` maps the return value
+        to the rows written (None to skip), falling back to no count when it does not apply.
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or function.__name__) as stage:
+                    result = function(*args, **kwargs)
+                    if rows:
+                        try:
+                            stage.rows_out = rows(result)
+                        except TypeError:
+                            pass
+                    return result
+            return wrapper
+        return decorator
+
+    def to_dict(self):
+        return {'job': self.job, 'labels': self.labels, 'started_at': self.started_at,
+                'wall_seconds': time.time() - self.started_at,
+                'stages': [stage.to_dict() for stage in self.stages]}
+
+    def to_prometheus(self):
+        """
+        Return:
+            {str} - the stages in the Prometheus text exposition format, one gauge per measurement
+        """
+        def label_string(stage_name):
+            labels = {'job': self.job, **self.labels, 'stage': stage_name}
+            return ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels.items())
+
+        lines = []
+        for measurement, description in PROMETHEUS_METRICS:
+            metric = f"etl_stage_{measurement}"
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} gauge"]
+            for stage in self.stages:
+                value = getattr(stage, measurement)
+                if value is not None:
+                    lines.append(f"{metric}{{{label_string(stage.name)}}} {int(value) if isinstance(value, bool) else value}")
+        lines += ["# HELP etl_run_started_timestamp_seconds Start time of the ETL run.",
+                  "# TYPE etl_run_started_timestamp_seconds gauge",
+                  f"etl_run_started_timestamp_seconds{{job=\"{_escape_label(self.job)}\"}} {self.started_at}"]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, *paths: str):
+        """
+        Write the report to every path, as a Prometheus textfile for `.prom` paths and as JSON otherwise.
+        Files are replaced atomically, so a textfile collector never reads a partial report.
+        """
+        for path in paths:
+            content = self.to_prometheus() if path.endswith('.prom') else json.dumps(self.to_dict(), indent=2,
+                                                                                     default=_json_value)
+            temporary_path = f"{path}.tmp"
+            with open(temporary_path, 'w') as f:
+                f.write(content)
+            os.replace(temporary_path, path)
+            logger.info(f"Metrics of {len(self.stages)} stages written to {path}")